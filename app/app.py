@@ -1,14 +1,22 @@
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas, NavigationToolbar2QT as NavigationToolbar
 from matplotlib.figure import Figure
 from matplotlib.axes import Axes
+from matplotlib.lines import Line2D
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from typing import *
 import copy
 
-from app.util import SchemeType, create_analytical, create_numerical
+from app.util import SchemeType
 from app.convergence_report import ConvergenceReport
+from app.result_cache import ResultCache
+from app.calculation_scheduler import CalculationScheduler
+from app.level_of_detail import LevelOfDetail
+from app.space_time_view import SpaceTimeView
+
+from app.process.process_stats import ProcessStats
+from app.process.cancellation import CancellationToken
 
 from app.process.numerically_calculated_process import NumericallyCalculatedProcess
 from app.process.analytically_calculated_process import AnalyticallyCalculatedProcess
@@ -23,11 +31,19 @@ class MainWindow(QWidget):
     toolbar: NavigationToolbar
     ax: Axes
     canvas: FigureCanvas
+    numerical_line: Optional[Line2D]
+    analytical_line: Optional[Line2D]
+    background: Any
+    numerical_lod: Optional[LevelOfDetail]
+    analytical_lod: Optional[LevelOfDetail]
+    redraw_timer: QTimer
+    redraw_pending: bool
 
     scheme_type_box: QComboBox
     show_analytical: QCheckBox
     slider: QSlider
     time_label: QLabel
+    stats_label: QLabel
 
     l_edit: QLineEdit
     t_edit: QLineEdit
@@ -45,6 +61,7 @@ class MainWindow(QWidget):
     convergence_reports: list
 
     convergence_report_btn: QPushButton
+    space_time_btn: QPushButton
     restore_defaults_btn: QPushButton
     plot_save_btn: QPushButton
 
@@ -53,13 +70,23 @@ class MainWindow(QWidget):
 
     successfully_parsed: bool
     params: List[float or int]
+    calculated_params: Optional[List[float or int]]
     editors: List[QLineEdit]
 
-    thread: QThread
+    scheduler: CalculationScheduler
+
+    cache: ResultCache
 
     def __init__(self):
         super().__init__()
         self.convergence_reports = []
+        self.space_time_views = []
+        self.cache = ResultCache()
+        self.scheduler = CalculationScheduler(self)
+        self.scheduler.calculated.connect(self.finish_change_handling)
+        self.scheduler.progress.connect(self.progress_handler)
+        self.scheduler.failed.connect(self.calculation_failed_handler)
+        self.calculated_params = None
         self.eps_changed = False
         self.create_ui()
         self.set_defaults()
@@ -70,54 +97,90 @@ class MainWindow(QWidget):
         self.parse_parameters()
         self.analytical = None
         self.remove_tooltips()
-        if self.successfully_parsed and (self.show_analytical.isChecked() or not self.eps_changed):
-            def calculate():
-                scheme_type = self.get_current_scheme_type()
-                self.numerical = create_numerical(scheme_type, self.params)
-                self.add_tooltips()
-                if self.show_analytical.isChecked():
-                    self.analytical = create_analytical(self.params)
-                return self
-            self.update_slider_range()
-            self.start_calculation_thread(calculate)
+        if not self.successfully_parsed:
+            self.scheduler.cancel()
+        elif self.show_analytical.isChecked() or not self.eps_changed:
+            self.start_calculation()
         self.eps_changed = False
 
     def scheme_type_change_handler(self):
-        def calculate():
-            scheme_type = self.get_current_scheme_type()
-            self.numerical = create_numerical(scheme_type, self.params)
-            self.add_tooltips()
-            return self
-        self.numerical = None
         self.remove_tooltips()
-        self.start_calculation_thread(calculate)
+        self.start_calculation()
 
     def show_analytical_change_handler(self, state):
         if state == Qt.Checked and self.analytical is None:
-            def calculate():
-                self.analytical = create_analytical(self.params)
-                return self
-            self.start_calculation_thread(calculate)
-        else:
-            self.finish_change_handling()
-
-    def start_calculation_thread(self, calculate: Callable):
-        self.thread = self.CalculationThread(calculate)
-        self.thread.calculated.connect(self.finish_change_handling)
+            self.start_calculation()
+        elif not self.scheduler.is_running():
+            self.slider_change_handler(self.slider.value())
+
+    def start_calculation(self):
+        # every request covers all the plot shows, so it can supersede any earlier one,
+        # the processes already in the cache are reused and the previous results are
+        # extended rather than recalculated if only the horizon or eps changed
+        scheme_type = self.get_current_scheme_type()
+        params = list(self.params)
+        show_analytical = self.show_analytical.isChecked()
+        base_params = self.calculated_params
+
+        def calculate(token: CancellationToken):
+            numerical = self.cache.get_numerical(scheme_type, params, ProcessStats(), base_params, token)
+            analytical = None
+            if show_analytical:
+                analytical = self.cache.get_analytical(params, lazy=True, base_params=base_params, token=token)
+            return params, numerical, analytical
         self.draw_loading()
-        self.set_ui_enabled(False)
-        self.thread.start()
+        self.set_plot_enabled(False)
+        self.scheduler.submit(calculate)
+
+    def progress_handler(self, percent: int):
+        self.time_label.setText("Выполняется вычисление: {}%".format(percent))
 
-    def finish_change_handling(self):
-        self.set_ui_enabled(True)
+    def finish_change_handling(self, result: Tuple):
+        self.calculated_params, self.numerical, self.analytical = result
+        self.add_tooltips()
+        self.update_slider_range()
+        self.set_plot_enabled(True)
         self.slider.setValue(0)
+        self.draw_plot(0)
         self.slider_change_handler(0)
+        self.update_stats_label()
         # self.eps_edit.setEnabled(self.show_analytical.isChecked())
 
+    def calculation_failed_handler(self, error: Exception):
+        # the last calculated process is shown again, if there is one
+        if self.calculated_params is not None:
+            self.set_plot_enabled(True)
+            self.draw_plot(self.slider.value())
+            self.slider_change_handler(self.slider.value())
+        else:
+            self.draw_message("Не удалось выполнить вычисление")
+            self.time_label.setText("")
+        QMessageBox.warning(self, "Ошибка", "Не удалось выполнить вычисление: {}".format(error))
+
     def slider_change_handler(self, index):
         t = self.numerical.get_tn()
         self.time_label.setText("Текущее время: {:.2f} c".format(t[index]))
-        self.draw_plot(index)
+        # the lines are redrawn at most once per frame, the latest index wins
+        if self.redraw_timer.isActive():
+            self.redraw_pending = True
+        else:
+            self.redraw_lines()
+            self.redraw_timer.start()
+
+    def redraw_timeout_handler(self):
+        if self.redraw_pending:
+            self.redraw_pending = False
+            self.redraw_lines()
+            self.redraw_timer.start()
+
+    def update_stats_label(self):
+        stats = self.numerical.get_stats()
+        if stats is None:
+            self.stats_label.setText("")
+            return
+        phases = stats["phases"]
+        self.stats_label.setText("Время расчёта: {:.3f} c (шаги по времени: {:.3f} c, запись: {:.3f} c)"
+                                 .format(stats["total_time"], phases.get("stepping", 0.), phases.get("storage", 0.)))
 
     def add_tooltips(self):
         self.x_num_edit.setToolTip("При текущих параметрах желательно как максимум {}"
@@ -130,29 +193,39 @@ class MainWindow(QWidget):
         self.t_num_edit.setToolTip("")
 
     def update_slider_range(self):
-        self.slider.setRange(0, self.get_t_num())
+        self.slider.setRange(0, self.numerical.get_t_num())
 
     def get_current_scheme_type(self):
         index = self.scheme_type_box.currentIndex()
         return self.scheme_type_box.model().item(index).data()
 
     def draw_loading(self):
+        self.draw_message("Выполняется вычисление...")
+
+    def draw_message(self, message: str):
+        self.numerical_line = self.analytical_line = self.background = None
+        self.numerical_lod = self.analytical_lod = None
         self.ax.clear()
         self.ax.axis("off")
-        self.ax.text(0.5, 0.5, "Выполняется вычисление...", va="center", ha="center", fontsize=15)
+        self.ax.text(0.5, 0.5, message, va="center", ha="center", fontsize=15)
         self.canvas.draw()
 
     def draw_plot(self, index):
+        # the lines are created once per calculated process and are animated,
+        # so scrubbing only updates their data and blits them over the background
         self.ax.clear()
         self.ax.axis("on")
-        x = self.numerical.get_xn()
-        y = self.numerical.get_solution_on(index)
-        self.ax.plot(x, y, color="purple", linewidth=2.0)
-
-        if self.show_analytical.isChecked():
-            x = self.analytical.get_xn()
-            y = self.analytical.get_solution_on(index)
-            self.ax.plot(x, y, color="orange", linestyle="--", linewidth=2.0)
+        self.numerical_lod = LevelOfDetail(self.numerical.get_xn(), self.numerical.get_solution_on)
+        self.analytical_lod = None
+        if self.analytical is not None:
+            self.analytical_lod = LevelOfDetail(self.analytical.get_xn(), self.analytical.get_solution_on)
+        self.numerical_line, = self.ax.plot([], [], color="purple", linewidth=2.0, animated=True)
+        self.analytical_line, = self.ax.plot([], [], color="orange", linestyle="--", linewidth=2.0, animated=True)
+        # the decimated layers keep the end nodes, so the limits match the full layers
+        xn = self.numerical.get_xn()
+        self.update_lines(index, (xn[0], xn[-1]))
+        self.ax.relim()
+        self.ax.autoscale_view(scaley=False)
 
         u0 = self.get_u0()
         self.ax.set_ylim(u0 - 0.5, u0 + 1.5)
@@ -162,6 +235,35 @@ class MainWindow(QWidget):
         self.ax.grid()
         self.canvas.draw()
 
+    def canvas_draw_handler(self, event):
+        # every full draw, e.g. on resize or zoom, renders the background without the animated lines
+        if self.numerical_line is None:
+            return
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self.update_lines(self.slider.value(), self.ax.get_xlim())
+        self.draw_lines()
+
+    def redraw_lines(self):
+        if self.numerical_line is None or self.background is None:
+            return
+        self.update_lines(self.slider.value(), self.ax.get_xlim())
+        self.canvas.restore_region(self.background)
+        self.draw_lines()
+        self.canvas.blit(self.ax.bbox)
+
+    def update_lines(self, index: int, x_range: Tuple[float, float]):
+        # only the visible nodes are plotted and they are decimated to the width of the axes
+        width = max(1, int(self.ax.bbox.width))
+        self.numerical_line.set_data(*self.numerical_lod.get(index, x_range, width))
+        show_analytical = self.show_analytical.isChecked() and self.analytical_lod is not None
+        self.analytical_line.set_visible(show_analytical)
+        if show_analytical:
+            self.analytical_line.set_data(*self.analytical_lod.get(index, x_range, width))
+
+    def draw_lines(self):
+        self.ax.draw_artist(self.numerical_line)
+        self.ax.draw_artist(self.analytical_line)
+
     def parse_parameters(self):
         params = []
         try:
@@ -191,16 +293,16 @@ class MainWindow(QWidget):
 
     def set_widgets_enabled(self, trigger):
         self.show_analytical.setEnabled(trigger)
-        self.slider.setEnabled(trigger)
         self.scheme_type_box.setEnabled(trigger)
         self.convergence_report_btn.setEnabled(trigger)
-        self.plot_save_btn.setEnabled(trigger)
+        self.space_time_btn.setEnabled(trigger and not self.scheduler.is_running())
+        self.set_plot_enabled(trigger and not self.scheduler.is_running())
 
-    def set_ui_enabled(self, trigger):
-        self.set_widgets_enabled(trigger)
-        self.restore_defaults_btn.setEnabled(trigger)
-        for i in range(len(self.editors)):
-            self.editors[i].setEnabled(trigger)
+    def set_plot_enabled(self, trigger):
+        # the editors stay enabled while calculating, an edit supersedes the running calculation
+        self.slider.setEnabled(trigger)
+        self.plot_save_btn.setEnabled(trigger)
+        self.space_time_btn.setEnabled(trigger)
 
     def get_u0(self) -> float:
         return self.params[6]
@@ -208,9 +310,16 @@ class MainWindow(QWidget):
     def get_t_num(self) -> int:
         return self.params[8]
 
+    def open_space_time_view(self):
+        u0 = self.get_u0()
+        view = SpaceTimeView(self.numerical, (u0 - 0.5, u0 + 1.5))
+        self.space_time_views.append(view)
+        view.set_close_handler(lambda: self.space_time_views.remove(view))
+        view.show()
+
     def open_convergence_report(self):
         scheme_type = copy.copy(self.get_current_scheme_type())
-        report = ConvergenceReport(self.params.copy(), scheme_type)
+        report = ConvergenceReport(self.params.copy(), scheme_type, self.cache)
         self.convergence_reports.append(report)
         report.set_close_handler(lambda: self.convergence_reports.remove(report))
         report.show()
@@ -220,6 +329,12 @@ class MainWindow(QWidget):
         self.ax = self.figure.add_subplot(111)
         self.canvas = FigureCanvas(self.figure)
         self.toolbar = NavigationToolbar(self.canvas, None)
+        self.numerical_line = self.analytical_line = self.background = None
+        self.numerical_lod = self.analytical_lod = None
+
+        self.redraw_timer = QTimer()
+        self.redraw_timer.setSingleShot(True)
+        self.redraw_pending = False
 
         self.scheme_type_box = QComboBox()
         self.show_analytical = QCheckBox()
@@ -250,7 +365,9 @@ class MainWindow(QWidget):
 
         self.slider = QSlider(Qt.Horizontal)
         self.time_label = QLabel()
+        self.stats_label = QLabel()
         self.convergence_report_btn = QPushButton()
+        self.space_time_btn = QPushButton()
         self.restore_defaults_btn = QPushButton()
         self.plot_save_btn = QPushButton()
 
@@ -278,30 +395,42 @@ class MainWindow(QWidget):
         inexplicit_item.setData(SchemeType.INEXPLICIT)
         self.scheme_type_box.model().appendRow(inexplicit_item)
 
+        crank_nicolson_item = QStandardItem("Схема Кранка — Николсон")
+        crank_nicolson_item.setData(SchemeType.CRANK_NICOLSON)
+        self.scheme_type_box.model().appendRow(crank_nicolson_item)
+
         self.show_analytical.setText("Наложить аналитическое решение")
 
         self.time_label.setAlignment(Qt.AlignCenter)
+        self.stats_label.setAlignment(Qt.AlignCenter)
 
         self.convergence_report_btn.setText("Экспериментальное исследование сходимости")
+        self.space_time_btn.setText("Пространственно-временная диаграмма")
         self.restore_defaults_btn.setText("Восстановить значения по умолчанию")
         self.plot_save_btn.setText("Сохранить изображение графика")
 
         self.scheme_type_box.currentIndexChanged.connect(self.scheme_type_change_handler)
         self.show_analytical.stateChanged.connect(self.show_analytical_change_handler)
         self.slider.valueChanged.connect(self.slider_change_handler)
+        self.canvas.mpl_connect("draw_event", self.canvas_draw_handler)
+        self.redraw_timer.setInterval(max(1, int(1000 / QGuiApplication.primaryScreen().refreshRate())))
+        self.redraw_timer.timeout.connect(self.redraw_timeout_handler)
         self.convergence_report_btn.clicked.connect(self.open_convergence_report)
+        self.space_time_btn.clicked.connect(self.open_space_time_view)
         self.restore_defaults_btn.clicked.connect(self.set_defaults)
         self.plot_save_btn.clicked.connect(self.toolbar.save_figure)
 
-        grid.addWidget(self.canvas, 0, 0, 6, 1)
+        grid.addWidget(self.canvas, 0, 0, 7, 1)
         grid.addWidget(self.scheme_type_box, 0, 1)
         grid.addWidget(self.show_analytical, 1, 1)
         grid.addLayout(self.create_form_layout(), 2, 1)
         grid.addWidget(self.convergence_report_btn, 3, 1)
         grid.addWidget(self.restore_defaults_btn, 4, 1)
         grid.addWidget(self.plot_save_btn, 5, 1)
-        grid.addWidget(self.slider, 6, 0, 1, 2)
-        grid.addWidget(self.time_label, 7, 0, 1, 2)
+        grid.addWidget(self.space_time_btn, 6, 1)
+        grid.addWidget(self.slider, 7, 0, 1, 2)
+        grid.addWidget(self.time_label, 8, 0, 1, 2)
+        grid.addWidget(self.stats_label, 9, 0, 1, 2)
 
         self.setLayout(grid)
         self.setWindowTitle("Процесс теплообмена в тонком стержне")
@@ -366,6 +495,11 @@ class MainWindow(QWidget):
         line_edit.textChanged.connect(handler)
 
     def closeEvent(self, event):
+        self.scheduler.cancel()
+        self.scheduler.wait()
+        while len(self.space_time_views) > 0:
+            for view in self.space_time_views:
+                view.close()
         while len(self.convergence_reports) > 0:
             for report in self.convergence_reports:
                 report.close()
@@ -377,16 +511,6 @@ class MainWindow(QWidget):
         qt_rectangle.moveCenter(center_point)
         self.move(qt_rectangle.topLeft())
 
-    class CalculationThread(QThread):
-        calculated = pyqtSignal(object)
-
-        def __init__(self, calculate: Callable):
-            super().__init__()
-            self.calculate = calculate
-
-        def run(self) -> None:
-            self.calculated.emit(self.calculate())
-
     class DoubleValidator(QDoubleValidator):
         def validate(self, p_str, p_int):
             return super().validate(p_str.replace(",", "."), p_int)
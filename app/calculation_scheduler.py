@@ -0,0 +1,81 @@
+from PyQt5.QtCore import *
+from typing import *
+
+from app.process.cancellation import CancellationToken, CalculationCancelled
+
+
+class CalculationScheduler(QObject):
+    # Runs one calculation at a time in a worker thread. A new request cancels
+    # the running calculation and replaces the one waiting for it, so fast edits
+    # never pile up calculations for parameters that are already stale. Only the
+    # result of the latest request is emitted, or the error it raised.
+    calculated = pyqtSignal(object)
+    failed = pyqtSignal(object)
+    progress = pyqtSignal(int)
+
+    def __init__(self, parent: Optional[QObject] = None):
+        super().__init__(parent)
+        self._worker = None
+        self._pending = None
+
+    def submit(self, calculate: Callable[[CancellationToken], Any]):
+        # calculate(token) runs in the worker thread and passes the token on to the processes
+        self._pending = calculate
+        if self._worker is not None:
+            self._worker.token.cancel()
+        else:
+            self._start_pending()
+
+    def cancel(self):
+        self._pending = None
+        if self._worker is not None:
+            self._worker.token.cancel()
+
+    def is_running(self) -> bool:
+        return self._worker is not None
+
+    def wait(self):
+        if self._worker is not None:
+            self._worker.wait()
+
+    def _start_pending(self):
+        calculate, self._pending = self._pending, None
+        self._worker = self.Worker(calculate)
+        self._worker.progress.connect(self.progress)
+        self._worker.finished.connect(self._worker_finished)
+        self._worker.start()
+
+    def _worker_finished(self):
+        # finished is emitted just before the thread ends, it has to end before the worker is released
+        worker, self._worker = self._worker, None
+        worker.wait()
+        worker.deleteLater()
+        if self._pending is not None:
+            self._start_pending()
+            return
+        if worker.token.is_cancelled():
+            return
+        if worker.error is not None:
+            self.failed.emit(worker.error)
+        elif worker.completed:
+            self.calculated.emit(worker.result)
+
+    class Worker(QThread):
+        progress = pyqtSignal(int)
+
+        def __init__(self, calculate: Callable[[CancellationToken], Any]):
+            super().__init__()
+            self.calculate = calculate
+            self.token = CancellationToken(self.progress.emit)
+            self.completed = False
+            self.result = None
+            self.error = None
+
+        def run(self) -> None:
+            try:
+                self.result = self.calculate(self.token)
+                self.completed = True
+            except CalculationCancelled:
+                pass
+            except Exception as error:
+                self.error = error
@@ -3,25 +3,29 @@ from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from typing import *
 from enum import Enum
-import numpy as np
 
-from app.util import SchemeType, create_analytical, create_numerical
-
-from app.process.numerically_calculated_process import NumericallyCalculatedProcess
-from app.process.analytically_calculated_process import AnalyticallyCalculatedProcess
+from app.util import SchemeType
+from app.convergence_runner import ConvergenceRunner, ConvergenceLevel, ErrorEstimation
+from app.result_cache import ResultCache
 
 
 class ConvergenceReport(QWidget):
 
     DEFAULT_STYLE = ""
     DANGER_STYLE = "color:white;background-color:#ff4747"
+    # the part of the horizon left out of the errors when the start-up is skipped
+    SKIPPED_FRACTION = 0.05
+    ERROR_HEADER = "Погрешность\nчисленного\nрешения"
 
     table: QTableWidget
 
     progress_bar: QProgressBar
     iterations_num_label: QLabel
     iterations_num_edit: QLineEdit
+    runge_check: QCheckBox
+    skip_startup_check: QCheckBox
     start_btn: QPushButton
+    cancel_btn: QPushButton
     close_btn: QPushButton
 
     close_handler: Callable
@@ -29,14 +33,20 @@ class ConvergenceReport(QWidget):
     iterations_num: int
     progress_bar_step: int
 
-    x_scale: int
-    t_scale: int
+    cache: Optional[ResultCache]
+    runner: Optional[ConvergenceRunner]
+    thread: Optional[QThread]
+    levels: List[Optional[ConvergenceLevel]]
 
-    def __init__(self, params: List[float or int], scheme_type: SchemeType):
+    def __init__(self, params: List[float or int], scheme_type: SchemeType, cache: Optional[ResultCache] = None):
         super().__init__()
-        self.columns_num = 9
+        self.columns_num = 10
         self.params = params
         self.scheme_type = scheme_type
+        self.cache = cache
+        self.runner = None
+        self.thread = None
+        self.levels = []
         self.create_ui()
         self.set_defaults()
         self.configure_ui()
@@ -45,54 +55,65 @@ class ConvergenceReport(QWidget):
     def start_convergence_report(self):
         self.set_layout(self.FooterLayout.PROGRESS)
         self.init_report_params()
-
-        analytical = create_analytical(self.params)
-        numerical = create_numerical(self.scheme_type, self.params)
-        error: float = self.get_calculation_error(analytical, numerical)
-        self.create_row(0, numerical, error, first_row=True)
-        prev_hx = numerical.get_hx()
-        prev_ht = numerical.get_ht()
-        prev_error = error
+        self.table.setRowCount(self.iterations_num)
+
+        estimation = ErrorEstimation.RUNGE if self.runge_check.isChecked() else ErrorEstimation.ANALYTICAL
+        skipped_fraction = self.SKIPPED_FRACTION if self.skip_startup_check.isChecked() else 0.
+        self.set_error_header(skipped_fraction)
+        self.runner = ConvergenceRunner(self.scheme_type, self.params, self.iterations_num, estimation=estimation,
+                                        cache=self.cache, skipped_fraction=skipped_fraction)
+        self.thread = self.ConvergenceThread(self.runner)
+        self.thread.level_calculated.connect(self.level_calculated_handler)
+        self.thread.finished.connect(self.finish_convergence_report)
+        self.thread.start()
+
+    def level_calculated_handler(self, level: ConvergenceLevel):
+        self.levels[level.index] = level
+        self.create_row(level.index)
+        if level.index + 1 < self.iterations_num:
+            self.create_row(level.index + 1)
         self.update_progress_bar()
 
-        for i in range(1, self.iterations_num):
-            self.params[7] *= self.x_scale
-            self.params[8] *= self.t_scale
-            analytical = create_analytical(self.params)
-            numerical = create_numerical(self.scheme_type, self.params)
-            error: float = self.get_calculation_error(analytical, numerical)
-            self.create_row(i, numerical, error, prev_hx, prev_ht, prev_error)
-            prev_hx = numerical.get_hx()
-            prev_ht = numerical.get_ht()
-            prev_error = error
-            self.update_progress_bar()
+    def cancel_convergence_report(self):
+        if self.runner is not None:
+            self.runner.cancel()
 
+    def finish_convergence_report(self):
         self.set_layout(self.FooterLayout.FINAL)
 
-    def create_row(self,
-                   row_index: int,
-                   numerical: NumericallyCalculatedProcess,
-                   error: float,
-                   prev_hx: float = None,
-                   prev_ht: float = None,
-                   prev_error: float = None,
-                   first_row: bool = False):
+    def set_error_header(self, skipped_fraction: float):
+        header = self.table.horizontalHeaderItem(5)
+        if skipped_fraction > 0:
+            header.setText("{}\nбез первых\n{:.0%} времени".format(self.ERROR_HEADER, skipped_fraction))
+        else:
+            header.setText(self.ERROR_HEADER)
+
+    def create_row(self, row_index: int):
+        level = self.levels[row_index]
+        if level is None:
+            return
+        prev_level = self.levels[row_index - 1] if row_index > 0 else None
+
         first_col = QTableWidgetItem(str(row_index + 1))
-        second_col = QTableWidgetItem(str(numerical.get_x_num()))
-        third_col = QTableWidgetItem(str(numerical.get_t_num()))
-        fourth_col = QTableWidgetItem(self.pretty_double(numerical.get_hx()))
-        fifth_col = QTableWidgetItem(self.pretty_double(numerical.get_ht()))
-        sixth_col = QTableWidgetItem(self.pretty_double(error))
-        if not first_row:
-            seventh_col = QTableWidgetItem(str(int(prev_hx / numerical.get_hx())))
-            eighth_col = QTableWidgetItem(str(int(prev_ht / numerical.get_ht())))
-            ninth_col = QTableWidgetItem(self.pretty_double(prev_error / error))
+        second_col = QTableWidgetItem(str(level.x_num))
+        third_col = QTableWidgetItem(str(level.t_num))
+        fourth_col = QTableWidgetItem(self.pretty_double(level.hx))
+        fifth_col = QTableWidgetItem(self.pretty_double(level.ht))
+        sixth_col = QTableWidgetItem(self.pretty_double(level.error))
+        if prev_level is not None:
+            seventh_col = QTableWidgetItem(str(int(prev_level.hx / level.hx)))
+            eighth_col = QTableWidgetItem(str(int(prev_level.ht / level.ht)))
+            ninth_col = QTableWidgetItem(self.pretty_double(prev_level.error / level.error))
         else:
             seventh_col = QTableWidgetItem("-")
             eighth_col = QTableWidgetItem("-")
             ninth_col = QTableWidgetItem("-")
+        # only the Runge estimation observes the order, on the levels with both neighbours
+        if level.observed_order is not None:
+            tenth_col = QTableWidgetItem("{:.2f}".format(level.observed_order))
+        else:
+            tenth_col = QTableWidgetItem("-")
 
-        self.table.insertRow(self.table.rowCount())
         self.table.setItem(row_index, 0, first_col)
         self.table.setItem(row_index, 1, second_col)
         self.table.setItem(row_index, 2, third_col)
@@ -102,6 +123,7 @@ class ConvergenceReport(QWidget):
         self.table.setItem(row_index, 6, seventh_col)
         self.table.setItem(row_index, 7, eighth_col)
         self.table.setItem(row_index, 8, ninth_col)
+        self.table.setItem(row_index, 9, tenth_col)
 
         self.table.update()
 
@@ -113,20 +135,10 @@ class ConvergenceReport(QWidget):
         current = self.progress_bar.value()
         self.progress_bar.setValue(current + self.progress_bar_step)
 
-    @staticmethod
-    def get_calculation_error(analytical: AnalyticallyCalculatedProcess,
-                              numerical: NumericallyCalculatedProcess):
-        errors: np.ndarray = np.absolute(numerical.get_solution() - analytical.get_solution())
-        return errors.max()
-
     def init_report_params(self):
-        self.params[7] = int(self.params[0])  # set the x_num equals to the l
-        numerical = create_numerical(self.scheme_type, self.params, False)
-        self.params[8] = numerical.get_min_t_num()  # set the t_num corresponding to the x_num
-        self.x_scale = 4 // numerical.get_x_convergence_rate()
-        self.t_scale = 4 // numerical.get_t_convergence_rate()
         self.iterations_num = int(self.iterations_num_edit.text())
         self.progress_bar_step = 100 // self.iterations_num
+        self.levels = [None] * self.iterations_num
 
     def iterations_num_change_handler(self):
         if self.iterations_num_edit.hasAcceptableInput():
@@ -141,7 +153,10 @@ class ConvergenceReport(QWidget):
         self.progress_bar = QProgressBar()
         self.iterations_num_label = QLabel()
         self.iterations_num_edit = QLineEdit()
+        self.runge_check = QCheckBox()
+        self.skip_startup_check = QCheckBox()
         self.start_btn = QPushButton()
+        self.cancel_btn = QPushButton()
         self.close_btn = QPushButton()
 
     def set_defaults(self):
@@ -155,10 +170,11 @@ class ConvergenceReport(QWidget):
             "Число\nинтервалов\nпо t",
             "Шаг\nпо x",
             "Шаг\nпо t",
-            "Погрешность\nчисленного\nрешения",
+            self.ERROR_HEADER,
             "Отношение\nшагов\nпо x",
             "Отношение\nшагов\nпо t",
-            "Отношение\nпогрешностей\nчисленного\nрешения"
+            "Отношение\nпогрешностей\nчисленного\nрешения",
+            "Наблюдаемый\nпорядок"
         ])
         self.table.horizontalHeader().setStretchLastSection(True)
         self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Fixed)
@@ -166,6 +182,14 @@ class ConvergenceReport(QWidget):
         self.table.setFixedWidth(self.get_table_width())
 
         self.iterations_num_label.setText("Количество итераций")
+        self.runge_check.setText("Оценка по правилу Рунге")
+        self.runge_check.setToolTip("Погрешность оценивается по решениям на соседних сетках "
+                                    "без вычисления аналитического решения")
+        self.skip_startup_check.setText("Без начального участка")
+        self.skip_startup_check.setToolTip("Погрешность считается без первых {:.0%} времени: начальный профиль "
+                                           "не согласован с теплоизолированными концами, поэтому в начале решение "
+                                           "негладкое и любая схема сходится там лишь с первым порядком"
+                                           .format(self.SKIPPED_FRACTION))
         self.start_btn.setText("Начать иследование")
         self.iterations_num_edit.setValidator(QIntValidator(1, 10))
         self.iterations_num_edit.setFixedWidth(30)
@@ -176,6 +200,9 @@ class ConvergenceReport(QWidget):
 
         self.progress_bar.setMaximum(100)
 
+        self.cancel_btn.setText("Отменить")
+        self.cancel_btn.clicked.connect(self.cancel_convergence_report)
+
         self.close_btn.setText("Закрыть")
         self.close_btn.clicked.connect(self.close)
 
@@ -187,10 +214,16 @@ class ConvergenceReport(QWidget):
         init_box.setAlignment(Qt.AlignCenter)
         init_box.addWidget(self.iterations_num_label)
         init_box.addWidget(self.iterations_num_edit)
+        init_box.addWidget(self.runge_check)
+        init_box.addWidget(self.skip_startup_check)
         init_box.addWidget(self.start_btn)
         layout.addLayout(init_box)
 
-        layout.addWidget(self.progress_bar)
+        progress_box = QHBoxLayout()
+        progress_box.addWidget(self.progress_bar)
+        progress_box.addWidget(self.cancel_btn)
+        layout.addLayout(progress_box)
+
         layout.addWidget(self.close_btn)
         self.setLayout(layout)
         self.setWindowTitle("Экспериментальное исследование сходимости")
@@ -208,6 +241,9 @@ class ConvergenceReport(QWidget):
         self.close_handler = close_handler
 
     def closeEvent(self, event):
+        self.cancel_convergence_report()
+        if self.thread is not None:
+            self.thread.wait()
         event.accept()
         if self.close_handler is not None:
             self.close_handler()
@@ -227,18 +263,37 @@ class ConvergenceReport(QWidget):
         if layout_type == self.FooterLayout.INIT:
             self.iterations_num_label.show()
             self.iterations_num_edit.show()
+            self.runge_check.show()
+            self.skip_startup_check.show()
             self.start_btn.show()
             self.progress_bar.hide()
+            self.cancel_btn.hide()
             self.close_btn.hide()
         elif layout_type == self.FooterLayout.PROGRESS:
             self.iterations_num_label.hide()
             self.iterations_num_edit.hide()
+            self.runge_check.hide()
+            self.skip_startup_check.hide()
             self.start_btn.hide()
             self.progress_bar.show()
+            self.cancel_btn.show()
             self.close_btn.hide()
         elif layout_type == self.FooterLayout.FINAL:
             self.iterations_num_label.hide()
             self.iterations_num_edit.hide()
+            self.runge_check.hide()
+            self.skip_startup_check.hide()
             self.start_btn.hide()
             self.progress_bar.hide()
+            self.cancel_btn.hide()
             self.close_btn.show()
+
+    class ConvergenceThread(QThread):
+        level_calculated = pyqtSignal(object)
+
+        def __init__(self, runner: ConvergenceRunner):
+            super().__init__()
+            self.runner = runner
+
+        def run(self) -> None:
+            self.runner.run(self.level_calculated.emit)
@@ -0,0 +1,344 @@
+from concurrent.futures import ProcessPoolExecutor, CancelledError, FIRST_COMPLETED, wait
+from enum import Enum
+from typing import *
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import numpy as np
+
+from app.util import SchemeType, create_analytical, create_numerical
+from app.result_cache import ResultCache
+
+from app.process.numerically_calculated_process import NumericallyCalculatedProcess
+from app.process.analytically_calculated_process import AnalyticallyCalculatedProcess
+from app.process.solution_storage import MemmapStorage
+from app.process.grid_function import GridFunction
+from app.process.cancellation import CancellationToken, CalculationCancelled, EventCancellationToken
+
+RESTRICTION_CHUNK_SIZE = 256
+
+# the cancellation event of the runner, set in every worker process of its pool
+_worker_cancelled = None
+
+
+class ErrorEstimation(Enum):
+    ANALYTICAL = 1  # compares every level with the analytical solution
+    RUNGE = 2  # compares successive levels with each other, phi may be arbitrary
+
+
+class ConvergenceLevel(NamedTuple):
+    index: int
+    x_num: int
+    t_num: int
+    hx: float
+    ht: float
+    error: float
+    observed_order: Optional[float] = None
+
+
+def get_refinement_scales(numerical: NumericallyCalculatedProcess) -> Tuple[int, int]:
+    # every level divides the error by 4
+    return 4 // numerical.get_x_convergence_rate(), 4 // numerical.get_t_convergence_rate()
+
+
+def get_refinement_levels(scheme_type: SchemeType,
+                          params: List[float or int],
+                          iterations_num: int) -> List[List[float or int]]:
+    params = list(params)
+    params[7] = int(params[0])  # set the x_num equals to the l
+    numerical = create_numerical(scheme_type, params, False)
+    params[8] = numerical.get_min_t_num()  # set the t_num corresponding to the x_num
+    x_scale, t_scale = get_refinement_scales(numerical)
+
+    levels = []
+    for i in range(iterations_num):
+        levels.append(list(params))
+        params[7] *= x_scale
+        params[8] *= t_scale
+    return levels
+
+
+def get_skipped_layers(t_num: int, skipped_fraction: float) -> int:
+    # the number of the first layers that are left out of the errors
+    return int(math.ceil(skipped_fraction * t_num))
+
+
+def get_calculation_error(analytical: AnalyticallyCalculatedProcess,
+                          numerical: NumericallyCalculatedProcess,
+                          skipped_fraction: float = 0.) -> float:
+    start = get_skipped_layers(numerical.get_t_num(), skipped_fraction)
+    errors: np.ndarray = np.absolute(numerical.get_solution()[start:] - analytical.get_solution()[start:])
+    return float(errors.max())
+
+
+def get_restricted_difference(coarse: np.ndarray,
+                              fine: np.ndarray,
+                              x_scale: int,
+                              t_scale: int,
+                              first: int = 0) -> float:
+    # the fine grid contains every coarse node, the strided view selects them without a copy,
+    # the coarse layers before first are skipped
+    restricted = fine[::t_scale, ::x_scale]
+    difference = 0.
+    for start in range(first, len(coarse), RESTRICTION_CHUNK_SIZE):
+        stop = start + RESTRICTION_CHUNK_SIZE
+        difference = max(difference, float(np.absolute(restricted[start:stop] - coarse[start:stop]).max()))
+    return difference
+
+
+def get_level(index: int, numerical: NumericallyCalculatedProcess, error: float) -> ConvergenceLevel:
+    return ConvergenceLevel(index,
+                            numerical.get_x_num(),
+                            numerical.get_t_num(),
+                            float(numerical.get_hx()),
+                            float(numerical.get_ht()),
+                            error)
+
+
+def _init_worker(cancelled):
+    global _worker_cancelled
+    _worker_cancelled = cancelled
+
+
+def _get_worker_token() -> Optional[CancellationToken]:
+    return EventCancellationToken(_worker_cancelled) if _worker_cancelled is not None else None
+
+
+def calculate_numerical_level(scheme_type: SchemeType,
+                              params: List[float or int],
+                              index: int,
+                              directory: str,
+                              phi: Optional[GridFunction or Callable] = None) -> ConvergenceLevel:
+    # the solution is left in the directory, its error is estimated once the neighbouring levels are ready
+    numerical = create_numerical(scheme_type, params, False, MemmapStorage(directory), phi=phi)
+    numerical.calculate(_get_worker_token())
+    return get_level(index, numerical, math.nan)
+
+
+def calculate_level(scheme_type: SchemeType,
+                    params: List[float or int],
+                    index: int,
+                    cache_directory: Optional[str] = None,
+                    skipped_fraction: float = 0.) -> ConvergenceLevel:
+    token = _get_worker_token()
+    if cache_directory is not None:
+        cache = ResultCache(directory=cache_directory)
+        analytical = cache.get_analytical(params, token=token)
+        numerical = cache.get_numerical(scheme_type, params, token=token)
+    else:
+        analytical = create_analytical(params, False)
+        analytical.calculate(token)
+        numerical = create_numerical(scheme_type, params, False)
+        numerical.calculate(token)
+    return get_level(index, numerical, get_calculation_error(analytical, numerical, skipped_fraction))
+
+
+class ConvergenceRunner:
+    # Runs the refinement levels of a convergence study in a process pool,
+    # every finished level is passed to the handler as soon as it is ready.
+    # The levels the cache already holds are estimated without a worker, the
+    # workers share the directory of the cache if it has one.
+    # The error is the maximum over all layers. An initial profile that does not
+    # meet the insulated ends makes the solution rough at first, where every
+    # scheme converges at first order only, skipped_fraction of the horizon at
+    # its start can be left out of the error to see the order of the scheme.
+    # A source phi is only supported by the Runge estimation, the analytical
+    # solution has none. It is sent to the workers, so it has to be picklable,
+    # e.g. a GridFunction of a module level function.
+
+    CANCELLATION_POLL_INTERVAL = 0.1
+
+    def __init__(self,
+                 scheme_type: SchemeType,
+                 params: List[float or int],
+                 iterations_num: int,
+                 max_workers: Optional[int] = None,
+                 cache_directory: Optional[str] = None,
+                 estimation: ErrorEstimation = ErrorEstimation.ANALYTICAL,
+                 cache: Optional[ResultCache] = None,
+                 skipped_fraction: float = 0.,
+                 phi: Optional[GridFunction or Callable] = None):
+        if not 0 <= skipped_fraction < 1:
+            raise ValueError("Skipped fraction must be in [0, 1), got {}".format(skipped_fraction))
+        if phi is not None and estimation != ErrorEstimation.RUNGE:
+            raise ValueError("A source is only supported by the Runge estimation")
+        self._scheme_type = scheme_type
+        self._phi = phi
+        self._skipped_fraction = skipped_fraction
+        self._cache = cache
+        if cache_directory is None and cache is not None:
+            cache_directory = cache.get_directory()
+        self._cache_directory = cache_directory
+        self._estimation = estimation
+        self._levels = get_refinement_levels(scheme_type, params, iterations_num)
+        numerical = create_numerical(scheme_type, self._levels[0], False)
+        self._x_scale, self._t_scale = get_refinement_scales(numerical)
+        # the factor every level divides the error by
+        self._refinement = self._t_scale ** numerical.get_t_convergence_rate()
+        self._max_workers = max_workers
+        self._futures = []
+        # workers are spawned rather than forked so they do not inherit GUI threads,
+        # they get the event and check it between layers
+        self._context = multiprocessing.get_context("spawn")
+        self._cancelled = self._context.Event()
+        self._lock = threading.Lock()
+
+    def run(self, level_handler: Optional[Callable[[ConvergenceLevel], None]] = None) -> List[ConvergenceLevel]:
+        if self._estimation == ErrorEstimation.RUNGE:
+            directory = tempfile.mkdtemp(prefix="convergence_")
+            try:
+                estimator = self.RungeEstimator(self, directory, level_handler)
+                self._run(calculate_numerical_level,
+                          lambda index: (estimator.get_directory(index), self._phi),
+                          estimator.add,
+                          range(len(self._levels)))
+                return estimator.get_levels()
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+
+        results = []
+
+        def add(level: ConvergenceLevel):
+            results.append(level)
+            if level_handler is not None:
+                level_handler(level)
+
+        indices = []
+        for index in range(len(self._levels)):
+            level = self._get_cached_level(index)
+            if level is not None:
+                add(level)
+            else:
+                indices.append(index)
+        self._run(calculate_level, lambda index: (self._cache_directory, self._skipped_fraction), add, indices)
+        return sorted(results, key=lambda level: level.index)
+
+    def _get_cached_level(self, index: int) -> Optional[ConvergenceLevel]:
+        if self._cache is None:
+            return None
+        params = self._levels[index]
+        analytical = self._cache.get(ResultCache.get_analytical_key(params))
+        numerical = self._cache.get(ResultCache.get_numerical_key(self._scheme_type, params))
+        if analytical is None or numerical is None or not analytical.is_calculated() \
+                or not numerical.is_calculated():
+            return None
+        return get_level(index, numerical, get_calculation_error(analytical, numerical, self._skipped_fraction))
+
+    def _run(self,
+             calculate: Callable[..., ConvergenceLevel],
+             get_extra_args: Callable[[int], Tuple],
+             add: Callable[[ConvergenceLevel], None],
+             indices: Sequence[int]):
+        executor = ProcessPoolExecutor(self._max_workers, self._context, _init_worker, (self._cancelled,))
+        try:
+            with self._lock:
+                if self._cancelled.is_set():
+                    return
+                # the finest levels take the longest, so they are started first
+                for index in reversed(indices):
+                    self._futures.append(executor.submit(calculate,
+                                                         self._scheme_type,
+                                                         self._levels[index],
+                                                         index,
+                                                         *get_extra_args(index)))
+            pending = set(self._futures)
+            while pending and not self._cancelled.is_set():
+                done, pending = wait(pending, self.CANCELLATION_POLL_INTERVAL, FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        level = future.result()
+                    except (CancelledError, CalculationCancelled):
+                        continue
+                    add(level)
+        finally:
+            # the running levels stop at their next layer after a cancellation
+            executor.shutdown(wait=True)
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled.set()
+            for future in self._futures:
+                future.cancel()
+
+    def is_cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def get_levels_num(self) -> int:
+        return len(self._levels)
+
+    def get_estimation(self) -> ErrorEstimation:
+        return self._estimation
+
+    def get_refinement_scales(self) -> Tuple[int, int]:
+        return self._x_scale, self._t_scale
+
+    def get_refinement(self) -> int:
+        return self._refinement
+
+    def get_skipped_fraction(self) -> float:
+        return self._skipped_fraction
+
+    class RungeEstimator:
+        # Collects the levels calculated by the workers. The difference d of two
+        # successive levels estimates the error of the coarse one as R d / (R - 1)
+        # and of the fine one as d / (R - 1), where R is the error refinement factor.
+        # A level is passed on once its neighbours are ready.
+        def __init__(self,
+                     runner: "ConvergenceRunner",
+                     directory: str,
+                     level_handler: Optional[Callable[[ConvergenceLevel], None]]):
+            self._runner = runner
+            self._directory = directory
+            self._level_handler = level_handler
+            self._calculated = {}
+            self._differences = {}
+            self._levels = {}
+
+        def get_directory(self, index: int) -> str:
+            return os.path.join(self._directory, "level_{:02d}".format(index))
+
+        def add(self, level: ConvergenceLevel):
+            self._calculated[level.index] = level
+            for index in range(self._runner.get_levels_num()):
+                if index not in self._levels and self._is_ready(index):
+                    self._levels[index] = self._estimate(index)
+                    if self._level_handler is not None:
+                        self._level_handler(self._levels[index])
+
+        def get_levels(self) -> List[ConvergenceLevel]:
+            return [self._levels[index] for index in sorted(self._levels)]
+
+        def _is_ready(self, index: int) -> bool:
+            neighbours = range(max(index - 1, 0), min(index + 2, self._runner.get_levels_num()))
+            return all(neighbour in self._calculated for neighbour in neighbours)
+
+        def _estimate(self, index: int) -> ConvergenceLevel:
+            refinement = self._runner.get_refinement()
+            coarser = self._get_difference(index - 1)
+            finer = self._get_difference(index)
+            if finer is not None:
+                error = refinement * finer / (refinement - 1)
+            elif coarser is not None:
+                error = coarser / (refinement - 1)
+            else:
+                error = math.nan
+
+            observed_order = None
+            if coarser is not None and finer is not None and finer > 0:
+                observed_order = math.log(coarser / finer) / math.log(self._runner.get_refinement_scales()[1])
+            return self._calculated[index]._replace(error=error, observed_order=observed_order)
+
+        def _get_difference(self, index: int) -> Optional[float]:
+            # the difference between the level and the next finer one
+            if index < 0 or index + 1 >= self._runner.get_levels_num():
+                return None
+            if index not in self._differences:
+                coarse = MemmapStorage(self.get_directory(index)).load_solution()
+                fine = MemmapStorage(self.get_directory(index + 1)).load_solution()
+                x_scale, t_scale = self._runner.get_refinement_scales()
+                first = get_skipped_layers(self._calculated[index].t_num, self._runner.get_skipped_fraction())
+                self._differences[index] = get_restricted_difference(coarse, fine, x_scale, t_scale, first)
+            return self._differences[index]
@@ -0,0 +1,166 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import *
+import argparse
+import csv
+import json
+import os
+import time
+import numpy as np
+
+from app.util import PARAMS_NAMES, SchemeType, create_analytical, create_numerical
+
+from app.process.numerically_calculated_process import NumericallyCalculatedProcess
+from app.process.analytically_calculated_process import AnalyticallyCalculatedProcess
+from app.process.solution_storage import MemoryStorage, MemmapStorage
+
+RESULTS_FILE = "results.csv"
+
+
+def parse_params(values: Dict[str, Any]) -> List[float or int]:
+    params = []
+    for i, name in enumerate(PARAMS_NAMES):
+        if name not in values:
+            raise ValueError("Missing parameter '{}'".format(name))
+        cast_func = int if i == 7 or i == 8 else float  # x_num and t_num params
+        params.append(cast_func(values[name]))
+    return params
+
+
+def parse_scheme_type(name: str) -> SchemeType:
+    try:
+        return SchemeType[name.strip().upper()]
+    except KeyError:
+        raise ValueError("Unknown scheme type '{}', expected one of: {}"
+                         .format(name, ", ".join(scheme.name.lower() for scheme in SchemeType)))
+
+
+def load_param_sets(path: str, default_scheme_type: SchemeType) -> List[Tuple[SchemeType, List[float or int]]]:
+    # a JSON list of objects or a CSV file with a header, the optional
+    # "scheme" field overrides the default scheme type of the row
+    with open(path, newline="") as file:
+        if path.endswith(".json"):
+            rows = json.load(file)
+        else:
+            rows = list(csv.DictReader(file))
+
+    param_sets = []
+    for row in rows:
+        scheme = row.get("scheme")
+        scheme_type = parse_scheme_type(scheme) if scheme else default_scheme_type
+        param_sets.append((scheme_type, parse_params(row)))
+    return param_sets
+
+
+def get_max_error(analytical: AnalyticallyCalculatedProcess,
+                  numerical: NumericallyCalculatedProcess) -> float:
+    # the analytical solution is streamed layer by layer instead of being materialized
+    error = 0.
+    for (_, exact), approximate in zip(analytical.iterate_layers(), numerical.get_solution()):
+        error = max(error, float(np.absolute(approximate - exact).max()))
+    return error
+
+
+def run_simulation(scheme_type: SchemeType,
+                   params: List[float or int],
+                   output_directory: Optional[str] = None,
+                   calculate_error: bool = True,
+                   storage_dtype: str = "float64") -> Dict[str, Any]:
+    if output_directory is not None:
+        storage = MemmapStorage(output_directory, storage_dtype)
+    else:
+        storage = MemoryStorage(storage_dtype)
+
+    start = time.perf_counter()
+    numerical = create_numerical(scheme_type, params, storage=storage)
+    elapsed = time.perf_counter() - start
+
+    result = {"scheme": scheme_type.name.lower()}
+    result.update(zip(PARAMS_NAMES, params))
+    result["hx"] = float(numerical.get_hx())
+    result["ht"] = float(numerical.get_ht())
+    result["time"] = elapsed
+    result["storage_dtype"] = storage_dtype
+    result["quantization_error"] = numerical.get_quantization_report()["max_error"]
+    if calculate_error:
+        analytical = create_analytical(params, calculate_immediately=False)
+        result["error"] = get_max_error(analytical, numerical)
+    return result
+
+
+def run_batch(param_sets: List[Tuple[SchemeType, List[float or int]]],
+              output_directory: str,
+              save_solutions: bool = True,
+              calculate_error: bool = True,
+              workers: int = 1,
+              storage_dtype: str = "float64") -> List[Dict[str, Any]]:
+    os.makedirs(output_directory, exist_ok=True)
+
+    tasks = []
+    for index, (scheme_type, params) in enumerate(param_sets):
+        run_directory = os.path.join(output_directory, "run_{:05d}".format(index)) if save_solutions else None
+        tasks.append((scheme_type, params, run_directory, calculate_error, storage_dtype))
+
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as executor:
+            results = list(executor.map(run_simulation, *zip(*tasks)))
+    else:
+        results = [run_simulation(*task) for task in tasks]
+
+    for index, result in enumerate(results):
+        result["index"] = index
+    write_results(results, os.path.join(output_directory, RESULTS_FILE))
+    return results
+
+
+def write_results(results: List[Dict[str, Any]], path: str):
+    fields = ["index", "scheme"] + PARAMS_NAMES + ["hx", "ht", "time", "error", "storage_dtype", "quantization_error"]
+    with open(path, "w", newline="") as file:
+        writer = csv.DictWriter(file, fields, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def create_argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Runs heat exchange simulations without the GUI.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--params", nargs=len(PARAMS_NAMES), metavar=tuple(PARAMS_NAMES),
+                        help="a single parameter set")
+    source.add_argument("--params-file",
+                        help="a JSON or CSV file with parameter sets, one per object or row")
+    parser.add_argument("--scheme", default="explicit",
+                        help="difference scheme: {} (default: explicit)"
+                        .format(", ".join(scheme.name.lower() for scheme in SchemeType)))
+    parser.add_argument("--output", required=True,
+                        help="directory for the results table and the solutions")
+    parser.add_argument("--no-solutions", action="store_true",
+                        help="do not write the numerical solutions to disk")
+    parser.add_argument("--no-error", action="store_true",
+                        help="do not compare with the analytical solution")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of worker processes")
+    parser.add_argument("--storage-dtype", choices=["float64", "float32", "float16"], default="float64",
+                        help="precision of the stored solutions, the schemes always step in float64")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = create_argument_parser()
+    args = parser.parse_args(argv)
+
+    try:
+        scheme_type = parse_scheme_type(args.scheme)
+        if args.params_file is not None:
+            param_sets = load_param_sets(args.params_file, scheme_type)
+        else:
+            param_sets = [(scheme_type, parse_params(dict(zip(PARAMS_NAMES, args.params))))]
+    except (ValueError, OSError) as error:
+        parser.error(str(error))
+
+    results = run_batch(param_sets,
+                        args.output,
+                        save_solutions=not args.no_solutions,
+                        calculate_error=not args.no_error,
+                        workers=args.workers,
+                        storage_dtype=args.storage_dtype)
+    print("{} simulation(s) written to {}".format(len(results), os.path.join(args.output, RESULTS_FILE)))
+    return 0
@@ -0,0 +1,51 @@
+from collections import OrderedDict
+from typing import *
+import numpy as np
+
+
+def decimate(x: np.ndarray, y: np.ndarray, buckets: int) -> Tuple[np.ndarray, np.ndarray]:
+    # Splits the nodes into buckets and keeps the minimum and the maximum of
+    # each one in their order, so the peaks of y survive. The end nodes are kept too.
+    n = len(x)
+    if n <= 2 * buckets:
+        return x, y
+    size = -(-n // buckets)
+    padded = np.empty(size * buckets)
+    padded[:n] = y
+    padded[n:] = y[-1]
+    rows = padded.reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+    lows = np.minimum(offsets + rows.argmin(axis=1), n - 1)
+    highs = np.minimum(offsets + rows.argmax(axis=1), n - 1)
+    indices = np.unique(np.concatenate(([0], lows, highs, [n - 1])))
+    return x[indices], y[indices]
+
+
+class LevelOfDetail:
+    # Layers of a process decimated to the width of the plot. A range of x that
+    # fits the width, e.g. after zooming in, is returned at full resolution.
+
+    CACHE_SIZE = 64
+
+    def __init__(self, xn: np.ndarray, get_layer: Callable[[int], np.ndarray]):
+        self._xn = xn
+        self._get_layer = get_layer
+        self._cache = OrderedDict()
+
+    def get(self, index: int, x_range: Tuple[float, float], width: int) -> Tuple[np.ndarray, np.ndarray]:
+        # one node beyond each end of the range keeps the line running to the border
+        start = max(int(np.searchsorted(self._xn, x_range[0], side="right")) - 1, 0)
+        end = min(int(np.searchsorted(self._xn, x_range[1], side="left")) + 1, len(self._xn))
+        if end - start <= 2 * width:
+            return self._xn[start:end], self._get_layer(index)[start:end]
+
+        key = (index, start, end, width)
+        data = self._cache.get(key)
+        if data is None:
+            data = decimate(self._xn[start:end], self._get_layer(index)[start:end], width)
+            self._cache[key] = data
+            if len(self._cache) > self.CACHE_SIZE:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        return data
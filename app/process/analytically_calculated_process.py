@@ -1,9 +1,20 @@
 from app.process.process import Process
+from app.process.solution_storage import SolutionStorage
+from app.process.process_stats import ProcessStats
+from app.process.grid_function import GridFunction
+from app.process.cancellation import CancellationToken
+from collections import OrderedDict
 from typing import *
 import numpy as np
 
 
 class AnalyticallyCalculatedProcess(Process):
+
+    MODES_CHUNK_SIZE = 512
+    EXP_UNDERFLOW = -746
+    LAYERS_CACHE_SIZE = 64
+    LAYERS_CHUNK_SIZE = 256
+
     def __init__(self,
                  l: float,
                  t: float,
@@ -12,32 +23,148 @@ class AnalyticallyCalculatedProcess(Process):
                  k: float,
                  c: float,
                  u0: float,
-                 phi: Callable,
-                 xi: Callable,
+                 phi: GridFunction or Callable,
+                 xi: GridFunction or Callable,
                  x_num: int,
                  t_num: int,
                  eps: int,
-                 calculate_immediately: bool = True):
+                 calculate_immediately: bool = True,
+                 lazy: bool = False,
+                 storage: Optional[SolutionStorage] = None,
+                 stats: Optional[ProcessStats] = None):
         self._eps = eps
-        super().__init__(l, t, s, a, k, c, u0, phi, xi, x_num, t_num, calculate_immediately)
+        self._modes = None
+        self._layers = OrderedDict()
+        super().__init__(l, t, s, a, k, c, u0, phi, xi, x_num, t_num, calculate_immediately and not lazy,
+                         storage, stats)
 
     def _calculate_process(self) -> np.ndarray:
+        with self._measure("storage"):
+            u = self._storage.allocate((self._t_num + 1, self._x_num + 1))
+        with self._measure("modes"):
+            self._get_modes()
+        with self._measure("series"):
+            return self._store_u(self._tn, u)
+
+    def iterate_layers(self) -> Iterator[Tuple[float, np.ndarray]]:
+        for start in range(0, self._t_num + 1, self.LAYERS_CHUNK_SIZE):
+            tn = self._tn[start:start + self.LAYERS_CHUNK_SIZE]
+            yield from zip(tn, self._calculate_u(tn))
+
+    def _calculate_u(self, tn: np.ndarray, res: Optional[np.ndarray] = None) -> np.ndarray:
         mu = -4 * self._a / (self._c * np.sqrt(self._s))
-        x, t = np.meshgrid(self._xn, self._tn)
-        u = self._calculate_u(x, t, mu)
-        return np.array(u)
-
-    def _calculate_u(self, x, t, mu):
-        res = 2 / 3 * np.exp(mu * t)
-        for i in range(1, self._calculate_n()):
-            nu = np.pi**2*i**2
-            res += (np.exp((-self._k*nu/(self._c*self._l**2) + mu)*t)
-                    * (-8/nu*(np.cos(np.pi*i) + 1))
-                    * np.cos(np.pi*i/self._l * x))
-        return res + self._u0
+        if res is None:
+            res = np.empty((len(tn), self._x_num + 1))
+        res[:] = (2 / 3 * np.exp(mu * tn))[:, np.newaxis]
+        self._add_modes(tn, res, 0)
+        res += self._u0
+        return res
+
+    def _store_u(self, tn: np.ndarray, u: np.ndarray) -> np.ndarray:
+        # the series is summed up in float64, a narrower solution gets it chunk by chunk
+        if u.dtype == np.float64:
+            return self._calculate_u(tn, u)
+        for start in range(0, len(tn), self.LAYERS_CHUNK_SIZE):
+            layers = self._calculate_u(tn[start:start + self.LAYERS_CHUNK_SIZE])
+            u[start:start + len(layers)] = layers
+            self._track_quantization(u[start:start + len(layers)], layers)
+        return u
+
+    def _add_modes(self, tn: np.ndarray, res: np.ndarray, first: int):
+        # adds the terms of the series starting with the mode number first
+        modes, coefficients, rates = self._get_modes()
+        for start in range(first, len(modes), self.MODES_CHUNK_SIZE):
+            self._check((start - first) / (len(modes) - first))
+            end = start + self.MODES_CHUNK_SIZE
+            # tn is ascending and the rates are negative, so once exp() underflows
+            # for the slowest mode of the chunk the remaining layers get nothing
+            rows = int(np.count_nonzero(rates[start] * tn > self.EXP_UNDERFLOW))
+            if rows == 0:
+                break
+            time_factors = np.exp(np.outer(tn[:rows], rates[start:end])) * coefficients[start:end]
+            basis = np.cos(np.outer(np.pi * modes[start:end] / self._l, self._xn))
+            res[:rows] += time_factors @ basis
+
+    def _extend_process(self, old_t_num: int, old_indices: np.ndarray) -> np.ndarray:
+        u = self._storage.grow(self._u, (self._t_num + 1, self._x_num + 1))
+        with self._measure("series"):
+            self._store_u(self._tn[old_t_num + 1:], u[old_t_num + 1:])
+        return u
+
+    def copy(self, stats: Optional[ProcessStats] = None) -> 'AnalyticallyCalculatedProcess':
+        process = super().copy(stats)
+        process._layers = OrderedDict()
+        return process
+
+    def refine(self, eps: float, token: Optional[CancellationToken] = None):
+        # a smaller eps only adds modes to the series, so only they are summed up
+        # the modes are added to a copy, the solution is replaced once it is refined
+        modes_num = len(self._get_modes()[0])
+        old_eps = self._eps
+        self._eps = eps
+        self._modes = None
+        self._layers.clear()
+        if self._u is None:
+            return
+        try:
+            if len(self._get_modes()[0]) < modes_num or self._u.dtype != np.float64:
+                # the rounded solution can not take the small terms of the new modes
+                self.calculate(token)
+                return
+            u = self._storage.grow(self._u, self._u.shape)
+            with self._checking(token), self._measure("series"):
+                self._add_modes(self._tn, u, modes_num)
+        except BaseException:
+            self._eps = old_eps
+            self._modes = None
+            self._layers.clear()
+            raise
+        self._u = u
+        self._storage.finalize(self._u, self.get_metadata())
+
+    def _get_modes(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        if self._modes is None:
+            mu = -4 * self._a / (self._c * np.sqrt(self._s))
+            # odd modes vanish since cos(pi*i) + 1 = 0, only even ones are kept
+            modes = np.arange(2, self._calculate_n(), 2, dtype=float)
+            nu = np.pi**2 * modes**2
+            coefficients = -16 / nu
+            rates = -self._k*nu/(self._c*self._l**2) + mu
+            self._modes = (modes, coefficients, rates)
+        return self._modes
 
     def _calculate_n(self) -> int:
         return int(np.ceil(16 / (self._eps*np.pi**2) - 1))
 
+    def get_solution(self) -> np.ndarray:
+        if self._u is None:
+            self.calculate()
+            self._layers.clear()
+        return self._u
+
+    def get_parameters(self) -> Dict[str, float or int]:
+        parameters = super().get_parameters()
+        parameters["eps"] = float(self._eps)
+        return parameters
+
+    def get_eps(self) -> float:
+        return self._eps
+
+    def get_truncation_estimate(self) -> float:
+        return self._eps
+
     def get_solution_on(self, index) -> np.ndarray:
-        return self._u[index]
+        if self._u is not None:
+            return self._u[index]
+        return self._get_layer(range(self._t_num + 1)[index])
+
+    def _get_layer(self, index: int) -> np.ndarray:
+        layer = self._layers.get(index)
+        if layer is None:
+            layer = self._calculate_u(self._tn[index:index + 1])[0]
+            self._layers[index] = layer
+            if len(self._layers) > self.LAYERS_CACHE_SIZE:
+                self._layers.popitem(last=False)
+        else:
+            self._layers.move_to_end(index)
+        return layer
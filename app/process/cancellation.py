@@ -0,0 +1,54 @@
+from typing import *
+
+
+class CalculationCancelled(Exception):
+    pass
+
+
+class CancellationToken:
+    # Shared by a calculation and the code that started it. The calculation
+    # calls check() between layers, which raises CalculationCancelled once
+    # cancel() was called and reports the progress in whole percents.
+    def __init__(self, progress_callback: Optional[Callable[[int], None]] = None):
+        self._cancelled = False
+        self._progress_callback = progress_callback
+        self._percent = -1
+
+    def cancel(self):
+        self._cancelled = True
+
+    def is_cancelled(self) -> bool:
+        return self._cancelled
+
+    def check(self, progress: Optional[float] = None):
+        if self._cancelled:
+            raise CalculationCancelled()
+        if progress is None or self._progress_callback is None:
+            return
+        percent = int(100 * progress)
+        if percent > self._percent:
+            self._percent = percent
+            self._progress_callback(percent)
+
+    def reset_progress(self):
+        # a new run of the same calculation reports from zero again
+        self._percent = -1
+
+
+class EventCancellationToken(CancellationToken):
+    # Cancelled through an event, e.g. a multiprocessing one shared with the
+    # process that started the calculation in a worker process.
+    def __init__(self, event, progress_callback: Optional[Callable[[int], None]] = None):
+        super().__init__(progress_callback)
+        self._event = event
+
+    def cancel(self):
+        self._event.set()
+
+    def is_cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def check(self, progress: Optional[float] = None):
+        if self._event.is_set():
+            raise CalculationCancelled()
+        super().check(progress)
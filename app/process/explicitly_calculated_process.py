@@ -1,8 +1,21 @@
 from app.process.numerically_calculated_process import NumericallyCalculatedProcess
+from app.process.snapshot_policy import SnapshotPolicy
+from app.process.solution_storage import SolutionStorage
+from app.process.process_stats import ProcessStats
+from app.process import kernels
+from app.process.kernels import Backend
+from app.process.grid_function import GridFunction
+from enum import Enum
 import numpy as np
 from typing import *
 
 
+class StabilityMode(Enum):
+    UNCHECKED = 1  # steps with ht whether it is stable or not
+    SUBCYCLE = 2  # splits every output step into stable internal steps
+    STRICT = 3  # refuses to create an unstable process
+
+
 class ExplicitlyCalculatedProcess(NumericallyCalculatedProcess):
     def __init__(self,
                  l: float,
@@ -12,55 +25,133 @@ class ExplicitlyCalculatedProcess(NumericallyCalculatedProcess):
                  k: float,
                  c: float,
                  u0: float,
-                 phi: Callable,
-                 xi: Callable,
+                 phi: GridFunction or Callable,
+                 xi: GridFunction or Callable,
                  x_num: int,
                  t_num: int,
-                 calculate_immediately: bool = True):
-        super().__init__(l, t, s, a, k, c, u0, phi, xi, x_num, t_num, calculate_immediately)
-
-    def _calculate_process(self) -> np.ndarray:
-        u = [[]]
-
-        for x in self._xn:
-            u[0].append(self._xi(x))
-
-        mu = self._ht * self._k / (self._c * self._hx ** 2)
-        th = self._ht * self._a / (self._c * np.sqrt(self._s))
-        nu = 4*th*self._u0
-
-        for k in range(1, self._t_num + 1):
-            u.append([])
-            u[k].append(self._calculate_first(u, mu, th, nu, k))
-
-            for i in range(1, self._x_num):
-                u[k].append(self._calculate_middle(u, mu, th, nu, k, i))
-
-            u[k].append(self._calculate_last(u, mu, th, nu, k))
-
-        return np.array(u)
+                 calculate_immediately: bool = True,
+                 snapshot_policy: Optional[SnapshotPolicy] = None,
+                 storage: Optional[SolutionStorage] = None,
+                 stats: Optional[ProcessStats] = None,
+                 backend: Optional[Backend] = None,
+                 stability: StabilityMode = StabilityMode.UNCHECKED):
+        self._stability = stability
+        super().__init__(l, t, s, a, k, c, u0, phi, xi, x_num, t_num, False, snapshot_policy, storage, stats,
+                         backend)
+        if stability == StabilityMode.STRICT and not self.is_stable():
+            raise ValueError("Explicit scheme is unstable with t_num = {}, at least {} time steps are required"
+                             .format(self._t_num, self.get_min_t_num()))
+        if calculate_immediately:
+            self.calculate()
+
+    def _create_step(self) -> Callable[[np.ndarray, np.ndarray, float], None]:
+        substeps_num = self.get_substeps_num()
+        ht = self._ht / substeps_num
+        mu = ht * self._k / (self._c * self._hx ** 2)
+        th = ht * self._a / (self._c * np.sqrt(self._s))
+        constant, source_at = self._create_source(ht)
+        nu = 4*th*self._u0 + constant
+
+        if self._backend == Backend.PYTHON:
+            zeros = [0.] * (self._x_num + 1)
+
+            def step_by_lists(p: List[float], t: float, mu, th, nu) -> List[float]:
+                for i in range(substeps_num):
+                    source = source_at(t + i*ht)
+                    p = self._step_by_lists(p, mu, th, nu, source.tolist() if source is not None else zeros)
+                return p
+
+            def step(prev: np.ndarray, out: np.ndarray, t: float):
+                if prev.ndim == 1:
+                    out[:] = step_by_lists(prev.tolist(), t, mu, th, nu)
+                else:
+                    # per-rod coefficients of shape (m, 1) are taken row by row
+                    rows = [np.broadcast_to(coefficient, (len(prev), 1))[:, 0] for coefficient in (mu, th, nu)]
+                    for j in range(len(prev)):
+                        out[j] = step_by_lists(prev[j].tolist(), t, *(float(row[j]) for row in rows))
+            return step
+
+        w = 1 - 2*mu - 4*th
+        if self._backend == Backend.NUMBA and np.ndim(w) == 0 and np.ndim(nu) == 0:
+            zeros = np.zeros(self._x_num + 1)
+
+            def single_step(prev: np.ndarray, out: np.ndarray, t: float):
+                source = source_at(t)
+                kernels.explicit_step(prev, out, w, mu, nu, source if source is not None else zeros)
+        else:
+            single_step = lambda prev, out, t: self._step(prev, out, w, mu, nu, source_at(t))
+        if substeps_num == 1:
+            return single_step
+
+        buffers = {}
+
+        def subcycled_step(prev: np.ndarray, out: np.ndarray, t: float):
+            # internal layers alternate between a buffer and out so that the last one lands in out
+            buffer = buffers.get(prev.shape)
+            if buffer is None:
+                buffer = buffers[prev.shape] = np.empty_like(prev)
+            source_layer = prev
+            for i in range(substeps_num):
+                target = out if (substeps_num - i) % 2 == 1 else buffer
+                single_step(source_layer, target, t + i*ht)
+                source_layer = target
+        return subcycled_step
+
+    @staticmethod
+    def _step(prev: np.ndarray, out: np.ndarray, w, mu, nu, source: Optional[np.ndarray]):
+        out[..., 1:-1] = w*prev[..., 1:-1] + mu*prev[..., 2:] + mu*prev[..., :-2] + nu
+        if prev.ndim == 1:
+            out[0] = w*prev[0] + 2*mu*prev[1] + nu
+            out[-1] = w*prev[-1] + 2*mu*prev[-2] + nu
+        else:
+            # boundary nodes are sliced rather than indexed so that per-rod
+            # coefficients of shape (m, 1) broadcast the same way as the interior
+            out[..., :1] = w*prev[..., :1] + 2*mu*prev[..., 1:2] + nu
+            out[..., -1:] = w*prev[..., -1:] + 2*mu*prev[..., -2:-1] + nu
+        if source is not None:
+            out += source
+
+    def _step_by_lists(self, p: List[float], mu, th, nu, source: List[float]) -> List[float]:
+        layer = [self._calculate_first(p, mu, th, nu, source)]
+        for i in range(1, self._x_num):
+            layer.append(self._calculate_middle(p, mu, th, nu, source, i))
+        layer.append(self._calculate_last(p, mu, th, nu, source))
+        return layer
+
+    def _calculate_first(self, p, mu, th, nu, source) -> float:
+        return (1 - 2*mu - 4*th)*p[0] + 2*mu*p[1] + nu + source[0]
+
+    def _calculate_middle(self, p, mu, th, nu, source, i) -> float:
+        return (1 - 2*mu - 4*th)*p[i] + mu*p[i+1] + mu*p[i-1] + nu + source[i]
+
+    def _calculate_last(self, p, mu, th, nu, source) -> float:
+        i = self._x_num
+        return (1 - 2*mu - 4*th)*p[i] + 2*mu*p[i-1] + nu + source[i]
 
-    def _calculate_first(self, u, mu, th, nu, k) -> float:
-        return (1 - 2*mu - 4*th)*u[k-1][0] + 2*mu*u[k-1][1] + nu + self._ht*self._phi(self._xn[0])
+    def get_max_stable_ht(self) -> float:
+        # the weight 1 - 2*mu - 4*th of the central node must not be negative
+        return 1 / (2*self._k/(self._c*self._hx**2) + 4*self._a/(self._c*np.sqrt(self._s)))
 
-    def _calculate_middle(self, u, mu, th, nu, k, i) -> float:
-        return (1 - 2*mu - 4*th)*u[k-1][i] + mu*u[k-1][i+1] + mu*u[k-1][i-1] + nu + self._ht*self._phi(self._xn[i])
+    def is_stable(self) -> bool:
+        return self._ht <= self.get_max_stable_ht()
 
-    def _calculate_last(self, u, mu, th, nu, k) -> float:
-        i = self._x_num
-        return (1 - 2*mu - 4*th)*u[k-1][i] + 2*mu*u[k-1][i-1] + nu + self._ht*self._phi(self._xn[i])
+    def get_substeps_num(self) -> int:
+        if self._stability != StabilityMode.SUBCYCLE or self.is_stable():
+            return 1
+        return int(np.ceil(self._ht / self.get_max_stable_ht()))
 
-    def get_solution_on(self, index) -> np.ndarray:
-        return self._u[index]
+    def get_stability_mode(self) -> StabilityMode:
+        return self._stability
 
     def get_max_x_num(self) -> int:
         res = self._l * np.sqrt(self._c*(self._c*np.sqrt(self._s)*self._t_num - 4*self._t*self._a)
                                 / (2*self._c*np.sqrt(self._s)*self._t*self._k))
-        return int(np.around(res))
+        # the most nodes is_stable() accepts, rounding up would suggest an unstable x_num
+        return int(np.floor(res))
 
     def get_min_t_num(self) -> int:
-        res = self._t * (2*self._k*self._x_num**2/(self._c*self._l**2) + 4*self._a/(self._c*np.sqrt(self._s)))
-        return int(np.around(res))
+        # the fewest steps is_stable() accepts, rounding down would suggest an unstable t_num
+        return int(np.ceil(self._t / self.get_max_stable_ht()))
 
     def get_x_convergence_rate(self) -> int:
         return 2
@@ -0,0 +1,88 @@
+from abc import ABC, abstractmethod
+from numbers import Real
+from typing import *
+import numpy as np
+
+
+class GridFunction(ABC):
+    # A source or an initial condition evaluated over the whole grid at once
+    # instead of a Python call per node.
+
+    @abstractmethod
+    def evaluate(self, xn: np.ndarray, t: float = 0.) -> np.ndarray:
+        pass
+
+    def is_time_dependent(self) -> bool:
+        return False
+
+    def get_constant(self, xn: np.ndarray) -> Optional[float]:
+        # the value when the function is the same at every node, solvers skip the array then
+        return None
+
+
+class ConstantFunction(GridFunction):
+    def __init__(self, value: float):
+        self._value = float(value)
+
+    def evaluate(self, xn: np.ndarray, t: float = 0.) -> np.ndarray:
+        return np.full(np.shape(xn), self._value)
+
+    def get_constant(self, xn: np.ndarray) -> Optional[float]:
+        return self._value
+
+
+class ArrayFunction(GridFunction):
+    # func(xn) or, for a time dependent function, func(xn, t) takes the whole grid
+    def __init__(self, func: Callable[..., np.ndarray], time_dependent: bool = False):
+        self._func = func
+        self._time_dependent = time_dependent
+
+    def evaluate(self, xn: np.ndarray, t: float = 0.) -> np.ndarray:
+        values = self._func(xn, t) if self._time_dependent else self._func(xn)
+        return np.array(np.broadcast_to(np.asarray(values, dtype=float), np.shape(xn)))
+
+    def is_time_dependent(self) -> bool:
+        return self._time_dependent
+
+
+class CallableFunction(GridFunction):
+    # Wraps a plain func(x). It is called with the whole grid first and is
+    # called per node if that fails in any way, e.g. it uses math, indexes or
+    # branches on x. A scalar result for the grid means the function is constant.
+    def __init__(self, func: Callable[[float], float]):
+        self._func = func
+        self._vectorized = None
+
+    def evaluate(self, xn: np.ndarray, t: float = 0.) -> np.ndarray:
+        values = self._evaluate_on_grid(xn)
+        if values is None:
+            return np.array([self._func(x) for x in xn], dtype=float)
+        return np.array(np.broadcast_to(values, np.shape(xn)))
+
+    def get_constant(self, xn: np.ndarray) -> Optional[float]:
+        values = self._evaluate_on_grid(xn)
+        if values is None or values.ndim != 0:
+            return None
+        return float(values)
+
+    def _evaluate_on_grid(self, xn: np.ndarray) -> Optional[np.ndarray]:
+        if self._vectorized is False:
+            return None
+        try:
+            values = np.asarray(self._func(xn), dtype=float)
+            if values.shape not in ((), np.shape(xn)):
+                raise ValueError("Unexpected shape {}".format(values.shape))
+        except Exception:
+            # a scalar-only function may raise anything on an array
+            self._vectorized = False
+            return None
+        self._vectorized = True
+        return values
+
+
+def as_grid_function(func: Optional[GridFunction or Callable or Real]) -> Optional[GridFunction]:
+    if func is None or isinstance(func, GridFunction):
+        return func
+    if isinstance(func, Real):
+        return ConstantFunction(func)
+    return CallableFunction(func)
@@ -1,9 +1,20 @@
 from app.process.numerically_calculated_process import NumericallyCalculatedProcess
+from app.process.snapshot_policy import SnapshotPolicy
+from app.process.solution_storage import SolutionStorage
+from app.process.process_stats import ProcessStats
+from app.process.tridiagonal_solver import TridiagonalSolver
+from app.process.kernels import Backend
+from app.process.grid_function import GridFunction
 import numpy as np
 from typing import *
 
 
 class InexplicitlyCalculatedProcess(NumericallyCalculatedProcess):
+    # With a tolerance the time step is chosen by step doubling: a step of
+    # 2^j base steps (ht = t / t_num) is compared with two halves of it and is
+    # accepted when they differ by at most the tolerance. The accepted layers lie
+    # on the base grid, get_tn() and get_t_num() describe them after calculate().
+    # The batches and the iterators choose their own grids and leave it as it is.
     def __init__(self,
                  l: float,
                  t: float,
@@ -12,45 +23,166 @@ class InexplicitlyCalculatedProcess(NumericallyCalculatedProcess):
                  k: float,
                  c: float,
                  u0: float,
-                 phi: Callable,
-                 xi: Callable,
+                 phi: GridFunction or Callable,
+                 xi: GridFunction or Callable,
                  x_num: int,
                  t_num: int,
-                 calculate_immediately: bool = True):
-        super().__init__(l, t, s, a, k, c, u0, phi, xi, x_num, t_num, calculate_immediately)
+                 calculate_immediately: bool = True,
+                 snapshot_policy: Optional[SnapshotPolicy] = None,
+                 storage: Optional[SolutionStorage] = None,
+                 stats: Optional[ProcessStats] = None,
+                 backend: Optional[Backend] = None,
+                 tolerance: Optional[float] = None):
+        if tolerance is not None and tolerance <= 0:
+            raise ValueError("Tolerance must be positive, got {}".format(tolerance))
+        self._tolerance = tolerance
+        self._base_t_num = int(t_num)
+        self._steps = {}
+        super().__init__(l, t, s, a, k, c, u0, phi, xi, x_num, t_num, calculate_immediately, snapshot_policy,
+                         storage, stats, backend)
 
     def _calculate_process(self) -> np.ndarray:
-        u = [[]]
-
-        for x in self._xn:
-            u[0].append(self._xi(x))
-
-        alpha = [0] * (self._x_num + 1)
-        beta = [0] * (self._x_num + 1)
-
-        gamma_1 = (self._k * self._ht) / (self._c * self._hx ** 2)
-        gamma_2 = (4 * self._a * self._ht) / (self._c * self._s ** 0.5)
-
-        for k in range(1, self._t_num + 1):
-            u.append([0] * (self._x_num + 1))
-
-            #alpha[0] = (1 + gamma_1 + gamma_2) * (1 - gamma_1) / gamma_1
-            alpha[0] = 1.
-            beta[0] = 0 #(u[k - 1][1] + gamma_2 * self._u0 + self._phi(self._xn[1])) * (2 + gamma_1 + gamma_2) / (1 + gamma_1 + gamma_2) - (u[k - 1][1] + gamma_2 * self._u0 + self._phi(self._xn[1])) / gamma_1
-
-            for i in range(1, self._x_num + 1):
-                if i == self._x_num:
-                    u[k][i] = beta[i - 1] / (1 - alpha[i - 1])
-                else:
-                    alpha[i] = gamma_1 / (1 + 2 * gamma_1 + gamma_2 - gamma_1 * alpha[i - 1])
-                    beta[i] = (u[k - 1][i] + gamma_2 * self._u0 + self._phi(self._xn[i]) + gamma_1 * beta[i - 1]) / (1 + 2 * gamma_1 + gamma_2 - gamma_1 * alpha[i - 1])
-            for i in range(self._x_num - 1, -1, -1):
-                u[k][i] = alpha[i] * u[k][i + 1] + beta[i]
-
-        return np.array(u)
-
-    def get_solution_on(self, index) -> np.ndarray:
-        return self._u[index]
+        if self._tolerance is None:
+            return super()._calculate_process()
+        with self._measure("initial"):
+            layer = self._initial_layer()
+        with self._measure("stepping"):
+            tn, layers = self._collect_layers(layer)
+        # only a completed run changes the grid of the process
+        self._set_time_grid(tn)
+        with self._measure("storage"):
+            u = self._storage.allocate((len(self.get_snapshot_indices()), self._x_num + 1))
+        return self._store_collected(layers, self.get_snapshot_indices(), u)
+
+    def calculate_batch(self, initial_layers: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # the adaptive grid of the batch is its own, the grid of the process is kept
+        if self._tolerance is None:
+            return super().calculate_batch(initial_layers)
+        tn, layers = self._collect_layers(np.array(initial_layers, dtype=float))
+        indices = self._snapshot_policy.get_indices(tn)
+        u = np.empty((len(indices),) + next(iter(layers.values())).shape)
+        return tn[indices], self._store_collected(layers, indices, u)
+
+    def _collect_layers(self, layer: np.ndarray) -> Tuple[np.ndarray, Dict[int, np.ndarray]]:
+        # The grid is only known once the stepping is over, so the accepted
+        # layers are kept until the snapshots can be selected from it. A layer
+        # the policy can not select whatever follows it is dropped as soon as
+        # the next one is accepted, its array takes that layer then.
+        tn = np.empty(self._base_t_num + 1)
+        layers = {}
+        k = 0
+        for k, (t, layer) in enumerate(self._iterate_from(layer)):
+            tn[k] = t
+            if k > 0 and not self._snapshot_policy.retains(tn[:k + 1], k - 1):
+                spare = layers.pop(k - 1)
+                spare[...] = layer
+                layers[k] = spare
+            else:
+                layers[k] = layer.copy()
+        return tn[:k + 1], layers
+
+    def _store_collected(self, layers: Dict[int, np.ndarray], indices: np.ndarray, u: np.ndarray) -> np.ndarray:
+        quantized = u.dtype != np.float64
+        for position, index in enumerate(indices):
+            u[position] = layers[index]
+            if quantized:
+                self._track_quantization(u[position], layers[index])
+        return u
+
+    def _iterate_from(self, layer: np.ndarray, start: int = 0) -> Iterator[Tuple[float, np.ndarray]]:
+        if self._tolerance is None:
+            return super()._iterate_from(layer, start)
+        return self._iterate_adaptive(layer)
+
+    def _iterate_adaptive(self, layer: np.ndarray) -> Iterator[Tuple[float, np.ndarray]]:
+        base_tn = np.linspace(0, self._t, self._base_t_num + 1)
+        indices = [0]
+        size = 1  # the step size in base steps
+        full, half, out = np.empty_like(layer), np.empty_like(layer), np.empty_like(layer)
+        yield base_tn[0], layer
+        while indices[-1] < self._base_t_num:
+            self._check(indices[-1] / self._base_t_num)
+            size = min(size, self._base_t_num - indices[-1])
+            ht = size * self._ht
+            t = base_tn[indices[-1]]
+            self._get_step(ht)(layer, full, t)
+            self._get_step(ht / 2)(layer, half, t)
+            self._get_step(ht / 2)(half, out, t + ht / 2)
+            error = float(np.absolute(out - full).max())
+            if error > self._tolerance and size > 1:
+                size //= 2
+                continue
+
+            indices.append(indices[-1] + size)
+            yield base_tn[indices[-1]], out
+            layer, out = out, layer
+            # the local error of the scheme grows as ht^2
+            if error * 4 <= self._tolerance:
+                size *= 2
+
+    def can_extend(self, t: float, t_num: int) -> bool:
+        # the adaptive grid is chosen for the whole horizon at once
+        return self._tolerance is None and super().can_extend(t, t_num)
+
+    def _set_time_grid(self, tn: np.ndarray):
+        self._tn = tn
+        self._t_num = len(tn) - 1
+        self._snapshot_indices = None
+
+    def _create_step(self) -> Callable[[np.ndarray, np.ndarray, float], None]:
+        return self._get_step(self._ht)
+
+    def _get_step(self, ht: float) -> Callable[[np.ndarray, np.ndarray, float], None]:
+        if ht not in self._steps:
+            self._steps[ht] = self._create_step_for(ht)
+        return self._steps[ht]
+
+    def _create_step_for(self, ht: float) -> Callable[[np.ndarray, np.ndarray, float], None]:
+        solver = self._create_solver(ht)
+        constant, source_at = self._create_source(ht)
+        gamma_2 = (4 * self._a * ht) / (self._c * self._s ** 0.5)
+        nu = gamma_2 * self._u0 + constant
+
+        def step(prev: np.ndarray, out: np.ndarray, t: float):
+            # the source is taken on the new layer
+            rhs = prev + nu
+            source = source_at(t + ht)
+            if source is not None:
+                rhs += source
+            rhs[..., 0] = 0
+            rhs[..., -1] = 0
+            solver.solve(rhs, out=out)
+        return step
+
+    def _create_solver(self, ht: float) -> TridiagonalSolver:
+        gamma_1 = (self._k * ht) / (self._c * self._hx ** 2)
+        gamma_2 = (4 * self._a * ht) / (self._c * self._s ** 0.5)
+
+        ones = np.ones(self._x_num + 1)
+        lower = -gamma_1 * ones
+        diagonal = (1 + 2 * gamma_1 + gamma_2) * ones
+        upper = -gamma_1 * ones
+
+        # u[0] = u[1] and u[n-1] = u[n-2]
+        lower[..., 0], diagonal[..., 0], upper[..., 0] = 0., 1., -1.
+        lower[..., -1], diagonal[..., -1], upper[..., -1] = -1., 1., 0.
+
+        return TridiagonalSolver(lower, diagonal, upper, self._backend)
+
+    def get_parameters(self) -> Dict[str, float or int]:
+        parameters = super().get_parameters()
+        if self._tolerance is not None:
+            parameters["tolerance"] = float(self._tolerance)
+        return parameters
+
+    def get_metadata(self) -> Dict[str, Any]:
+        metadata = super().get_metadata()
+        if self._tolerance is not None:
+            metadata["tn"] = self._tn.tolist()
+        return metadata
+
+    def get_tolerance(self) -> Optional[float]:
+        return self._tolerance
 
     def get_max_x_num(self) -> int:
         return self._l
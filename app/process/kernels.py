@@ -0,0 +1,103 @@
+from enum import Enum
+from typing import *
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+class Backend(Enum):
+    PYTHON = 1  # plain float lists, no numpy call per node
+    NUMPY = 2  # array operations, lists where the arrays are too small to pay off
+    NUMBA = 3  # compiled loops, available when numba is installed
+
+
+_default_backend = None
+
+
+def is_available(backend: Backend) -> bool:
+    return backend != Backend.NUMBA or numba is not None
+
+
+def get_available_backends() -> List[Backend]:
+    return [backend for backend in Backend if is_available(backend)]
+
+
+def get_default_backend() -> Backend:
+    if _default_backend is not None:
+        return _default_backend
+    return Backend.NUMBA if numba is not None else Backend.NUMPY
+
+
+def set_default_backend(backend: Optional[Backend]):
+    # None restores the automatic choice
+    global _default_backend
+    if backend is not None and not is_available(backend):
+        raise ValueError("Backend {} is not available, install numba to use it".format(backend.name.lower()))
+    _default_backend = backend
+
+
+def resolve_backend(backend: Optional[Backend]) -> Backend:
+    if backend is None:
+        return get_default_backend()
+    if not is_available(backend):
+        raise ValueError("Backend {} is not available, install numba to use it".format(backend.name.lower()))
+    return backend
+
+
+if numba is not None:
+    # The loops repeat the operations of the numpy and list paths in the same
+    # order, so all backends give identical results. Compiled kernels are cached
+    # next to this module and are only compiled on the first run.
+
+    @numba.njit(cache=True)
+    def _explicit_step(prev, out, w, mu, nu, source):
+        n = prev.shape[0]
+        for i in range(1, n - 1):
+            out[i] = w*prev[i] + mu*prev[i+1] + mu*prev[i-1] + nu + source[i]
+        out[0] = w*prev[0] + 2*mu*prev[1] + nu + source[0]
+        out[n-1] = w*prev[n-1] + 2*mu*prev[n-2] + nu + source[n-1]
+
+    @numba.njit(cache=True)
+    def _explicit_step_batch(prev, out, w, mu, nu, source):
+        for j in range(prev.shape[0]):
+            _explicit_step(prev[j], out[j], w, mu, nu, source)
+
+    @numba.njit(cache=True)
+    def _solve_tridiagonal(lower, alpha, denominator, rhs, out):
+        n = rhs.shape[0]
+        beta = np.empty(n)
+        beta[0] = rhs[0] / denominator[0]
+        for i in range(1, n):
+            beta[i] = (rhs[i] - lower[i] * beta[i - 1]) / denominator[i]
+
+        out[n - 1] = beta[n - 1]
+        for i in range(n - 2, -1, -1):
+            out[i] = alpha[i] * out[i + 1] + beta[i]
+
+    @numba.njit(cache=True)
+    def _solve_tridiagonal_batch(lower, alpha, denominator, rhs, out):
+        for j in range(rhs.shape[0]):
+            _solve_tridiagonal(lower, alpha, denominator, rhs[j], out[j])
+
+
+def explicit_step(prev: np.ndarray, out: np.ndarray, w: float, mu: float, nu: float, source: np.ndarray):
+    # scalar coefficients only, a (n,) layer or a (m, n) batch of them
+    if prev.ndim == 1:
+        _explicit_step(prev, out, w, mu, nu, source)
+    else:
+        _explicit_step_batch(prev, out, w, mu, nu, source)
+
+
+def solve_tridiagonal(lower: np.ndarray,
+                      alpha: np.ndarray,
+                      denominator: np.ndarray,
+                      rhs: np.ndarray,
+                      out: np.ndarray):
+    # coefficients shared by all systems, rhs is (n,) or (m, n)
+    if rhs.ndim == 1:
+        _solve_tridiagonal(lower, alpha, denominator, rhs, out)
+    else:
+        _solve_tridiagonal_batch(lower, alpha, denominator, rhs, out)
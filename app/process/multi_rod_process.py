@@ -0,0 +1,88 @@
+from app.process.numerically_calculated_process import NumericallyCalculatedProcess
+from app.process.snapshot_policy import SnapshotPolicy
+from app.process.solution_storage import SolutionStorage
+from app.process.process_stats import ProcessStats
+from app.process.kernels import Backend
+from app.process.grid_function import GridFunction, as_grid_function
+import numpy as np
+from typing import *
+
+
+class MultiRodProcess(NumericallyCalculatedProcess):
+    # Independent rods that share the rod and the grid but have their own
+    # initial profiles and ambient temperatures. The scheme advances all of them
+    # per time step as one (rods, x_num + 1) layer, so the Python overhead of a
+    # step does not grow with the number of rods. The solution is stored as
+    # (snapshots, rods, x_num + 1), a layer of all rods is contiguous.
+    def __init__(self,
+                 scheme: Type[NumericallyCalculatedProcess],
+                 l: float,
+                 t: float,
+                 s: float,
+                 a: float,
+                 k: float,
+                 c: float,
+                 u0: Sequence[float],
+                 phi: GridFunction or Callable,
+                 xi: Sequence[GridFunction or Callable],
+                 x_num: int,
+                 t_num: int,
+                 calculate_immediately: bool = True,
+                 snapshot_policy: Optional[SnapshotPolicy] = None,
+                 storage: Optional[SolutionStorage] = None,
+                 stats: Optional[ProcessStats] = None,
+                 backend: Optional[Backend] = None):
+        if len(u0) != len(xi):
+            raise ValueError("Every rod needs an ambient temperature and an initial profile, got {} and {}"
+                             .format(len(u0), len(xi)))
+        if len(u0) == 0:
+            raise ValueError("At least one rod is required")
+        self._u0s = np.array(u0, dtype=float)
+        self._xis = [as_grid_function(func) for func in xi]
+        # the scheme only builds the steps, the ambient temperature is a (rods, 1) column there
+        self._scheme = scheme(l, t, s, a, k, c, self._u0s[:, np.newaxis], phi, None, x_num, t_num,
+                              calculate_immediately=False, backend=backend)
+        super().__init__(l, t, s, a, k, c, self._u0s[:, np.newaxis], phi, None, x_num, t_num,
+                         calculate_immediately, snapshot_policy, storage, stats, backend)
+
+    def _create_step(self) -> Callable[[np.ndarray, np.ndarray, float], None]:
+        # an extended run keeps ht, which is all the steps depend on besides the time they get
+        return self._scheme._create_step()
+
+    def _initial_layer(self) -> np.ndarray:
+        return np.array([xi.evaluate(self._xn) for xi in self._xis])
+
+    def _get_layer_shape(self) -> Tuple[int, ...]:
+        return len(self._xis), self._x_num + 1
+
+    def get_solution_on(self, index, rod: Optional[int] = None) -> np.ndarray:
+        # the layer of all rods, or of a single one
+        layer = super().get_solution_on(index)
+        return layer if rod is None else layer[rod]
+
+    def get_rod_solution(self, rod: int) -> np.ndarray:
+        # a strided view, copy it to work with one rod for long
+        return self._u[:, rod]
+
+    def get_rods_num(self) -> int:
+        return len(self._xis)
+
+    def get_scheme(self) -> NumericallyCalculatedProcess:
+        return self._scheme
+
+    def get_parameters(self) -> Dict[str, Any]:
+        parameters = super().get_parameters()
+        parameters["u0"] = self._u0s.tolist()
+        return parameters
+
+    def get_max_x_num(self) -> int:
+        return self._scheme.get_max_x_num()
+
+    def get_min_t_num(self) -> int:
+        return self._scheme.get_min_t_num()
+
+    def get_x_convergence_rate(self) -> int:
+        return self._scheme.get_x_convergence_rate()
+
+    def get_t_convergence_rate(self) -> int:
+        return self._scheme.get_t_convergence_rate()
@@ -1,6 +1,13 @@
 from app.process.process import Process
+from app.process.snapshot_policy import SnapshotPolicy
+from app.process.solution_storage import SolutionStorage
+from app.process.process_stats import ProcessStats
+from app.process import kernels
+from app.process.kernels import Backend
+from app.process.grid_function import GridFunction
 from abc import ABC, abstractmethod
 from typing import *
+import numpy as np
 
 
 class NumericallyCalculatedProcess(Process, ABC):
@@ -12,12 +19,129 @@ class NumericallyCalculatedProcess(Process, ABC):
                  k: float,
                  c: float,
                  u0: float,
-                 phi: Callable,
-                 xi: Callable,
+                 phi: GridFunction or Callable,
+                 xi: GridFunction or Callable,
                  x_num: int,
                  t_num: int,
-                 calculate_immediately: bool = True):
-        super().__init__(l, t, s, a, k, c, u0, phi, xi, x_num, t_num, calculate_immediately)
+                 calculate_immediately: bool = True,
+                 snapshot_policy: Optional[SnapshotPolicy] = None,
+                 storage: Optional[SolutionStorage] = None,
+                 stats: Optional[ProcessStats] = None,
+                 backend: Optional[Backend] = None):
+        self._backend = kernels.resolve_backend(backend)
+        self._snapshot_policy = snapshot_policy if snapshot_policy is not None else SnapshotPolicy.all_layers()
+        self._snapshot_indices = None
+        self._last_layer = None
+        super().__init__(l, t, s, a, k, c, u0, phi, xi, x_num, t_num, calculate_immediately, storage, stats)
+
+    def _calculate_process(self) -> np.ndarray:
+        with self._measure("storage"):
+            u = self._storage.allocate((len(self.get_snapshot_indices()),) + self._get_layer_shape())
+        with self._measure("initial"):
+            layer = self._initial_layer()
+        with self._measure("stepping"):
+            return self._store_snapshots(self._remember_last_layer(self._iterate_from(layer)), u)
+
+    def _create_time_grid(self):
+        super()._create_time_grid()
+        self._snapshot_indices = None
+
+    def _extend_process(self, old_t_num: int, old_indices: np.ndarray) -> np.ndarray:
+        indices = self.get_snapshot_indices()
+        layer = self._get_last_layer(old_t_num, old_indices)
+        if layer is None or not np.array_equal(indices[:len(old_indices)], old_indices):
+            # the policy keeps other layers on the longer grid, or the last one is gone
+            return self._calculate_process()
+        with self._measure("storage"):
+            u = self._storage.grow(self._u, (len(indices),) + self._get_layer_shape())
+        with self._measure("stepping"):
+            # the iteration writes into the layer it starts from, the remembered one is kept
+            layers = self._remember_last_layer(self._iterate_from(np.array(layer), old_t_num))
+            return self._store_snapshots(layers, u, old_t_num, len(old_indices))
+
+    def _get_last_layer(self, t_num: int, indices: np.ndarray) -> Optional[np.ndarray]:
+        if self._last_layer is not None:
+            return self._last_layer
+        if len(indices) > 0 and indices[-1] == t_num:
+            # a solution stored in a narrower dtype continues from the rounded layer
+            return np.array(self._u[-1], dtype=float)
+        return None
+
+    def _remember_last_layer(self, layers: Iterator[Tuple[float, np.ndarray]]) -> Iterator[Tuple[float, np.ndarray]]:
+        layer = None
+        for t, layer in layers:
+            yield t, layer
+        self._last_layer = np.array(layer)
+
+    def calculate_batch(self, initial_layers: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # the times of the retained layers and the layers of the whole batch
+        initial_layers = np.array(initial_layers, dtype=float)
+        u = np.empty((len(self.get_snapshot_indices()),) + initial_layers.shape)
+        return self.get_snapshot_tn(), self._store_snapshots(self._iterate_from(initial_layers), u)
+
+    def iterate_layers(self) -> Iterator[Tuple[float, np.ndarray]]:
+        return self._iterate_from(self._initial_layer())
+
+    def iterate_batch(self, initial_layers: np.ndarray) -> Iterator[Tuple[float, np.ndarray]]:
+        return self._iterate_from(np.array(initial_layers, dtype=float))
+
+    def _iterate_from(self, layer: np.ndarray, start: int = 0) -> Iterator[Tuple[float, np.ndarray]]:
+        # only two layers are alive at a time, the yielded array is reused
+        # for later layers, so copy it if it has to outlive the iteration step
+        step = self._create_step()
+        out = np.empty_like(layer)
+        yield self._tn[start], layer
+        for k in range(start + 1, self._t_num + 1):
+            self._check(k / self._t_num)
+            step(layer, out, self._tn[k - 1])
+            yield self._tn[k], out
+            layer, out = out, layer
+
+    def _store_snapshots(self,
+                         layers: Iterator[Tuple[float, np.ndarray]],
+                         u: np.ndarray,
+                         start: int = 0,
+                         position: int = 0) -> np.ndarray:
+        # the layers begin with the layer start, the snapshots before position are already stored
+        indices = self.get_snapshot_indices()
+        quantized = u.dtype != np.float64
+        for k, (_, layer) in enumerate(layers, start):
+            if position < len(indices) and indices[position] == k:
+                u[position] = layer
+                if quantized:
+                    self._track_quantization(u[position], layer)
+                position += 1
+        return u
+
+    def _initial_layer(self) -> np.ndarray:
+        return self._xi.evaluate(self._xn)
+
+    def _get_layer_shape(self) -> Tuple[int, ...]:
+        return self._x_num + 1,
+
+    def _create_source(self, scale: float) -> Tuple[float, Callable[[float], Optional[np.ndarray]]]:
+        # scale * phi split into a constant that the schemes add to their scalar
+        # term and a function of time giving the rest of it, None when there is none
+        if self._phi.is_time_dependent():
+            return 0., lambda t: scale * self._phi.evaluate(self._xn, t)
+        constant = self._phi.get_constant(self._xn)
+        if constant is not None:
+            return scale * constant, lambda t: None
+        source = scale * self._phi.evaluate(self._xn)
+        return 0., lambda t: source
+
+    @abstractmethod
+    def _create_step(self) -> Callable[[np.ndarray, np.ndarray, float], None]:
+        # step(prev, out, t) writes the layer following the layer prev at the time t into out
+        pass
+
+    def get_backend(self) -> Backend:
+        return self._backend
+
+    def get_snapshot_indices(self) -> np.ndarray:
+        if self._snapshot_indices is None:
+            self._snapshot_indices = self._snapshot_policy.get_indices(self._tn)
+        return self._snapshot_indices
 
     @abstractmethod
     def get_max_x_num(self) -> int:
@@ -34,3 +158,7 @@ class NumericallyCalculatedProcess(Process, ABC):
     @abstractmethod
     def get_t_convergence_rate(self) -> int:
         pass
+
+    def get_truncation_estimate(self) -> float:
+        # the leading terms of the truncation error without their constants
+        return float(self._hx ** self.get_x_convergence_rate() + self._ht ** self.get_t_convergence_rate())
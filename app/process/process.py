@@ -1,6 +1,12 @@
+from app.process.solution_storage import SolutionStorage, MemoryStorage, MemmapStorage
+from app.process.process_stats import ProcessStats, NO_MEASUREMENT
+from app.process.grid_function import GridFunction, as_grid_function
+from app.process.cancellation import CancellationToken
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
 from typing import *
 import numpy as np
+import copy
 
 
 class Process(ABC):
@@ -12,11 +18,16 @@ class Process(ABC):
                  k: float,
                  c: float,
                  u0: float,
-                 phi: Callable,
-                 xi: Callable,
+                 phi: GridFunction or Callable,
+                 xi: GridFunction or Callable,
                  x_num: int,
                  t_num: int,
-                 calculate_immediately: bool = True):
+                 calculate_immediately: bool = True,
+                 storage: Optional[SolutionStorage] = None,
+                 stats: Optional[ProcessStats] = None):
+        self._stats = stats
+        self._token = None
+        self._quantization_error = 0.
         self._l = l
         self._t = t
         self._s = s
@@ -24,29 +35,189 @@ class Process(ABC):
         self._k = k
         self._c = c
         self._u0 = u0
-        self._phi = phi
-        self._xi = xi
+        self._phi = as_grid_function(phi)
+        self._xi = as_grid_function(xi)
         self._x_num = int(x_num)
         self._t_num = int(t_num)
-        self._xn, self._hx = np.linspace(0, self._l, self._x_num + 1, retstep=True)
-        self._tn, self._ht = np.linspace(0, self._t, self._t_num + 1, retstep=True)
+        with self._measure("grid"):
+            self._xn, self._hx = np.linspace(0, self._l, self._x_num + 1, retstep=True)
+            self._create_time_grid()
+        self._storage = storage if storage is not None else MemoryStorage()
+        self._u = None
         if calculate_immediately:
-            self._u = self._calculate_process()
+            self.calculate()
+
+    def calculate(self, token: Optional[CancellationToken] = None):
+        # the token cancels the run between layers, the previous solution is kept then
+        if self._stats is not None:
+            self._stats.start()
+        self._quantization_error = 0.
+        try:
+            with self._checking(token):
+                u = self._calculate_process()
+        except BaseException:
+            self._abort_stats()
+            raise
+        self._u = u
+        with self._measure("storage"):
+            self._storage.finalize(self._u, self.get_metadata())
+        if self._stats is not None:
+            self._stats.finish(self)
+
+    def _create_time_grid(self):
+        self._tn, self._ht = np.linspace(0, self._t, self._t_num + 1, retstep=True)
+
+    def can_extend(self, t: float, t_num: int) -> bool:
+        # the layers already calculated stay valid when the horizon grows with the same step
+        t_num = int(t_num)
+        return t_num > self._t_num and bool(np.isclose(t / t_num, self._ht, rtol=1e-12, atol=0))
+
+    def extend(self, t: float, t_num: int, token: Optional[CancellationToken] = None):
+        # continues the run up to the new horizon, only the new layers are calculated
+        if not self.can_extend(t, t_num):
+            raise ValueError("Process can not be extended to t = {} with t_num = {}".format(t, t_num))
+        old_t, old_t_num = self._t, self._t_num
+        old_indices = self.get_snapshot_indices()
+        self._t = t
+        self._t_num = int(t_num)
+        self._create_time_grid()
+        if self._u is None:
+            return
+        if self._stats is not None:
+            self._stats.start()
+        try:
+            with self._checking(token):
+                self._u = self._extend_process(old_t_num, old_indices)
+        except BaseException:
+            self._t, self._t_num = old_t, old_t_num
+            self._create_time_grid()
+            self._abort_stats()
+            raise
+        with self._measure("storage"):
+            self._storage.finalize(self._u, self.get_metadata())
+        if self._stats is not None:
+            self._stats.finish(self)
+
+    def _extend_process(self, old_t_num: int, old_indices: np.ndarray) -> np.ndarray:
+        return self._calculate_process()
+
+    def _abort_stats(self):
+        if self._stats is not None:
+            self._stats.abort()
+
+    @contextmanager
+    def _checking(self, token: Optional[CancellationToken]):
+        self._token = token
+        try:
+            yield
+        finally:
+            self._token = None
+
+    def _check(self, progress: float):
+        if self._token is not None:
+            self._token.check(progress)
+
+    def _measure(self, phase: str) -> ContextManager:
+        if self._stats is None:
+            return NO_MEASUREMENT
+        return self._stats.measure(phase)
+
+    def get_stats(self) -> Optional[Dict[str, Any]]:
+        if self._stats is None:
+            return None
+        return self._stats.get()
 
-    def calculate(self):
-        self._u = self._calculate_process()
+    def copy(self, stats: Optional[ProcessStats] = None) -> 'Process':
+        # Shares the solution with this process. extend and refine replace the
+        # solution of the copy rather than write into it, so the copy may be
+        # extended while this process is in use elsewhere.
+        process = copy.copy(self)
+        process._stats = stats
+        process._token = None
+        return process
+
+    def load(self, storage: MemmapStorage):
+        if storage.load_metadata() != self.get_metadata():
+            raise ValueError("Solution stored in {} belongs to a different process".format(storage.get_directory()))
+        self._u = storage.load_solution()
 
     @abstractmethod
     def _calculate_process(self):
         pass
 
     @abstractmethod
-    def get_solution_on(self, index) -> np.ndarray:
+    def iterate_layers(self) -> Iterator[Tuple[float, np.ndarray]]:
         pass
 
+    def get_solution_on(self, index) -> np.ndarray:
+        return self._u[self._get_snapshot_position(index)]
+
+    def _get_snapshot_position(self, index: int) -> int:
+        index = range(self._t_num + 1)[index]
+        indices = self.get_snapshot_indices()
+        if len(indices) == self._t_num + 1:
+            return index
+        position = int(np.searchsorted(indices, index))
+        if position == len(indices) or indices[position] != index:
+            raise IndexError("Time layer {} is not retained by the snapshot policy".format(index))
+        return position
+
+    def get_snapshot_indices(self) -> np.ndarray:
+        return np.arange(self._t_num + 1)
+
+    def get_snapshot_tn(self) -> np.ndarray:
+        return self._tn[self.get_snapshot_indices()]
+
     def get_solution(self):
         return self._u
 
+    def get_storage_dtype(self) -> np.dtype:
+        return self._u.dtype if self._u is not None else self._storage.get_dtype()
+
+    def get_truncation_estimate(self) -> Optional[float]:
+        # the order of the error the method makes anyway, None if it is unknown
+        return None
+
+    def get_quantization_report(self) -> Dict[str, Any]:
+        # The largest rounding error of the stored layers next to the truncation
+        # estimate, a ratio well below one means the narrow dtype loses nothing
+        # the method itself resolves.
+        truncation = self.get_truncation_estimate()
+        error = self._quantization_error
+        return {
+            "dtype": str(self.get_storage_dtype()),
+            "max_error": error,
+            "truncation_estimate": truncation,
+            "ratio": error / truncation if truncation else None
+        }
+
+    def _track_quantization(self, stored: np.ndarray, exact: np.ndarray):
+        if stored.dtype != exact.dtype:
+            self._quantization_error = max(self._quantization_error, float(np.absolute(stored - exact).max()))
+
+    def is_calculated(self) -> bool:
+        return self._u is not None
+
+    def get_parameters(self) -> Dict[str, float or int]:
+        return {
+            "l": float(self._l),
+            "t": float(self._t),
+            "s": float(self._s),
+            "a": float(self._a),
+            "k": float(self._k),
+            "c": float(self._c),
+            "u0": np.asarray(self._u0, dtype=float).tolist(),
+            "x_num": self._x_num,
+            "t_num": self._t_num
+        }
+
+    def get_metadata(self) -> Dict[str, Any]:
+        return {
+            "process": type(self).__name__,
+            "parameters": self.get_parameters(),
+            "snapshot_indices": self.get_snapshot_indices().tolist()
+        }
+
     def get_xn(self) -> np.ndarray:
         return self._xn
 
@@ -0,0 +1,84 @@
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from typing import *
+import json
+import logging
+import time
+import tracemalloc
+
+NO_MEASUREMENT = nullcontext()
+
+
+class ProcessStats:
+    # Collects per-phase timings of a process run. Memory tracing relies on
+    # tracemalloc, which slows allocations down, so it is enabled separately.
+    def __init__(self,
+                 trace_memory: bool = False,
+                 logger: Optional[logging.Logger] = None,
+                 json_path: Optional[str] = None):
+        self._trace_memory = trace_memory
+        self._logger = logger
+        self._json_path = json_path
+        self._owns_tracing = False
+        self._phases = OrderedDict()
+        self._stats = {}
+
+    @contextmanager
+    def measure(self, phase: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._phases[phase] = self._phases.get(phase, 0.) + time.perf_counter() - start
+
+    def start(self):
+        # the grid is built once by the constructor, every other phase belongs to the run
+        grid = self._phases.get("grid")
+        self._phases.clear()
+        if grid is not None:
+            self._phases["grid"] = grid
+        self._stats = {}
+        if self._trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._owns_tracing = True
+
+    def finish(self, process):
+        u = process.get_solution()
+        self._stats = {
+            "process": type(process).__name__,
+            "x_num": process.get_x_num(),
+            "t_num": process.get_t_num(),
+            "layers": process.get_t_num() + 1,
+            "retained_layers": len(process.get_snapshot_indices()),
+            "solution_bytes": int(u.nbytes) if u is not None else 0,
+            "storage_dtype": str(process.get_storage_dtype())
+        }
+        if tracemalloc.is_tracing():
+            self._stats["peak_memory"] = tracemalloc.get_traced_memory()[1]
+            if self._owns_tracing:
+                tracemalloc.stop()
+                self._owns_tracing = False
+
+        if self._logger is not None:
+            self.emit_to_log(self._logger)
+        if self._json_path is not None:
+            self.emit_to_json(self._json_path)
+
+    def abort(self):
+        # a failed or cancelled run reports nothing, but must not leave tracing on
+        if self._owns_tracing:
+            tracemalloc.stop()
+            self._owns_tracing = False
+
+    def get(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats["phases"] = dict(self._phases)
+        stats["total_time"] = sum(self._phases.values())
+        return stats
+
+    def emit_to_log(self, logger: logging.Logger, level: int = logging.INFO):
+        logger.log(level, "%s", json.dumps(self.get()))
+
+    def emit_to_json(self, path: str):
+        with open(path, "w") as file:
+            json.dump(self.get(), file, indent=4)
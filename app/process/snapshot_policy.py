@@ -0,0 +1,52 @@
+from typing import *
+import numpy as np
+
+
+class SnapshotPolicy:
+    # Decides which time layers a process keeps in memory while stepping.
+    # Use the factory methods instead of the constructor.
+
+    def __init__(self,
+                 select: Callable[[np.ndarray], Iterable[int]],
+                 retain: Optional[Callable[[np.ndarray, int], bool]] = None):
+        self._select = select
+        self._retain = retain
+
+    def get_indices(self, tn: np.ndarray) -> np.ndarray:
+        indices = np.unique(np.asarray(list(self._select(tn)), dtype=int))
+        return indices[(indices >= 0) & (indices < len(tn))]
+
+    def retains(self, tn: np.ndarray, index: int) -> bool:
+        # whether the layer index may be selected on a grid that begins with tn,
+        # tn ends after index, so a grid that is built while stepping can drop
+        # the layers that are not retained before it is complete
+        return self._retain is None or bool(self._retain(tn, index))
+
+    @staticmethod
+    def all_layers() -> 'SnapshotPolicy':
+        return SnapshotPolicy(lambda tn: range(len(tn)), lambda tn, index: True)
+
+    @staticmethod
+    def every(k: int) -> 'SnapshotPolicy':
+        if k < 1:
+            raise ValueError("Snapshot interval must be positive, got {}".format(k))
+        return SnapshotPolicy(lambda tn: range(0, len(tn), k), lambda tn, index: index % k == 0)
+
+    @staticmethod
+    def at_times(times: Iterable[float]) -> 'SnapshotPolicy':
+        times = np.asarray(list(times), dtype=float)
+
+        def select(tn: np.ndarray) -> np.ndarray:
+            right = np.clip(np.searchsorted(tn, times), 1, len(tn) - 1)
+            left = right - 1
+            return np.where(times - tn[left] <= tn[right] - times, left, right)
+
+        def retain(tn: np.ndarray, index: int) -> bool:
+            # the nearest layer is decided by the neighbours of the layer alone
+            start = max(index - 1, 0)
+            return index - start in select(tn[start:index + 2])
+        return SnapshotPolicy(select, retain)
+
+    @staticmethod
+    def final_only() -> 'SnapshotPolicy':
+        return SnapshotPolicy(lambda tn: [len(tn) - 1], lambda tn, index: False)
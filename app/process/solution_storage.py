@@ -0,0 +1,89 @@
+from abc import ABC, abstractmethod
+from typing import *
+import numpy as np
+import json
+import os
+
+
+class SolutionStorage(ABC):
+    # The dtype only applies to the stored solution, the processes step in
+    # float64 and round each retained layer once, when it is stored.
+    def __init__(self, dtype=np.float64):
+        self._dtype = np.dtype(dtype)
+
+    @abstractmethod
+    def allocate(self, shape: Tuple[int, ...], dtype=None) -> np.ndarray:
+        pass
+
+    def get_dtype(self) -> np.dtype:
+        return self._dtype
+
+    def grow(self, u: np.ndarray, shape: Tuple[int, ...]) -> np.ndarray:
+        # an array of the larger shape that starts with the rows of u
+        grown = self.allocate(shape, u.dtype)
+        grown[:len(u)] = u
+        return grown
+
+    def finalize(self, u: np.ndarray, metadata: Dict[str, Any]):
+        pass
+
+
+class MemoryStorage(SolutionStorage):
+    def allocate(self, shape: Tuple[int, ...], dtype=None) -> np.ndarray:
+        return np.empty(shape, dtype=dtype if dtype is not None else self._dtype)
+
+
+class MemmapStorage(SolutionStorage):
+    # A solution is written to a pending file that replaces the solution file
+    # only when it is finalized, so a failed or cancelled run keeps the previous
+    # solution and the maps of it that are already handed out stay valid.
+    SOLUTION_FILE = "solution.npy"
+    PENDING_FILE = "solution.pending.npy"
+    METADATA_FILE = "metadata.json"
+
+    def __init__(self, directory: str, dtype=np.float64):
+        super().__init__(dtype)
+        self._directory = directory
+
+    def allocate(self, shape: Tuple[int, ...], dtype=None) -> np.ndarray:
+        os.makedirs(self._directory, exist_ok=True)
+        dtype = dtype if dtype is not None else self._dtype
+        return np.lib.format.open_memmap(self.get_pending_path(), mode="w+", dtype=dtype, shape=tuple(shape))
+
+    def grow(self, u: np.ndarray, shape: Tuple[int, ...]) -> np.ndarray:
+        # u may be a map of the pending file itself, so the grown solution is
+        # written next to it and takes its place once it is complete
+        path = self.get_pending_path() + ".grow"
+        os.makedirs(self._directory, exist_ok=True)
+        grown = np.lib.format.open_memmap(path, mode="w+", dtype=u.dtype, shape=tuple(shape))
+        grown[:len(u)] = u
+        grown.flush()
+        os.replace(path, self.get_pending_path())
+        return grown
+
+    def finalize(self, u: np.ndarray, metadata: Dict[str, Any]):
+        if isinstance(u, np.memmap):
+            u.flush()
+        if os.path.exists(self.get_pending_path()):
+            os.replace(self.get_pending_path(), self.get_solution_path())
+        with open(self.get_metadata_path(), "w") as file:
+            json.dump(metadata, file, indent=4)
+
+    def load_solution(self, mode: str = "r") -> np.ndarray:
+        return np.load(self.get_solution_path(), mmap_mode=mode)
+
+    def load_metadata(self) -> Dict[str, Any]:
+        with open(self.get_metadata_path()) as file:
+            return json.load(file)
+
+    def get_directory(self) -> str:
+        return self._directory
+
+    def get_solution_path(self) -> str:
+        return os.path.join(self._directory, self.SOLUTION_FILE)
+
+    def get_pending_path(self) -> str:
+        return os.path.join(self._directory, self.PENDING_FILE)
+
+    def get_metadata_path(self) -> str:
+        return os.path.join(self._directory, self.METADATA_FILE)
@@ -0,0 +1,51 @@
+from app.process.process import Process
+from app.process.solution_storage import MemmapStorage
+from typing import *
+import numpy as np
+
+
+class StoredProcess(Process):
+    # Reopens a run written by MemmapStorage without recomputing it,
+    # the solution is a read-only memory map of the stored file.
+    def __init__(self, directory: str):
+        self._stored = MemmapStorage(directory)
+        self._metadata = self._stored.load_metadata()
+        self._snapshot_indices = np.asarray(self._metadata["snapshot_indices"], dtype=int)
+        parameters = self._metadata["parameters"]
+        super().__init__(parameters["l"],
+                         parameters["t"],
+                         parameters["s"],
+                         parameters["a"],
+                         parameters["k"],
+                         parameters["c"],
+                         parameters["u0"],
+                         None,
+                         None,
+                         parameters["x_num"],
+                         parameters["t_num"],
+                         calculate_immediately=False)
+        if "tn" in self._metadata:
+            # runs with a non-uniform time grid store it explicitly
+            self._tn = np.asarray(self._metadata["tn"], dtype=float)
+        self._u = self._calculate_process()
+
+    def _calculate_process(self) -> np.ndarray:
+        return self._stored.load_solution()
+
+    def can_extend(self, t: float, t_num: int) -> bool:
+        return False
+
+    def iterate_layers(self) -> Iterator[Tuple[float, np.ndarray]]:
+        return zip(self.get_snapshot_tn(), self._u)
+
+    def get_snapshot_indices(self) -> np.ndarray:
+        return self._snapshot_indices
+
+    def get_parameters(self) -> Dict[str, float or int]:
+        return dict(self._metadata["parameters"])
+
+    def get_metadata(self) -> Dict[str, Any]:
+        return dict(self._metadata)
+
+    def get_process_name(self) -> str:
+        return self._metadata["process"]
@@ -0,0 +1,117 @@
+from app.process import kernels
+from app.process.kernels import Backend
+from typing import *
+import numpy as np
+
+
+class TridiagonalSolver:
+    # Solves lower[i]*u[i-1] + diagonal[i]*u[i] + upper[i]*u[i+1] = rhs[i]
+    # for a constant matrix: the sweep coefficients are computed once.
+    # Coefficients of shape (m, n) describe m different systems solved together.
+
+    # below this batch size the per-row numpy overhead outweighs the gain
+    MIN_VECTORIZED_BATCH = 32
+
+    def __init__(self,
+                 lower: np.ndarray,
+                 diagonal: np.ndarray,
+                 upper: np.ndarray,
+                 backend: Optional[Backend] = None):
+        self._backend = kernels.resolve_backend(backend)
+        lower, diagonal, upper = np.broadcast_arrays(np.asarray(lower, dtype=float),
+                                                     np.asarray(diagonal, dtype=float),
+                                                     np.asarray(upper, dtype=float))
+        n = diagonal.shape[-1]
+        alpha = np.empty(diagonal.shape)
+        denominator = np.empty(diagonal.shape)
+
+        denominator[..., 0] = diagonal[..., 0]
+        alpha[..., 0] = -upper[..., 0] / denominator[..., 0]
+        for i in range(1, n):
+            denominator[..., i] = diagonal[..., i] + lower[..., i] * alpha[..., i - 1]
+            alpha[..., i] = -upper[..., i] / denominator[..., i]
+
+        self._n = n
+        self._lower = np.array(lower)
+        self._alpha = alpha
+        self._denominator = denominator
+        self._lower_list = self._get_columns(self._lower)
+        self._alpha_list = self._get_columns(alpha)
+        self._denominator_list = self._get_columns(denominator)
+        self._rows_lists = None
+
+    @staticmethod
+    def _get_columns(coefficients: np.ndarray) -> List[float] or np.ndarray:
+        # plain floats are the fastest to index for a single system, systems
+        # with their own coefficients get an (n, m) array with a row per node
+        if coefficients.ndim == 1:
+            return coefficients.tolist()
+        return np.ascontiguousarray(np.transpose(coefficients))
+
+    def solve(self, rhs: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        # rhs is either (n,) or a batch of independent systems (m, n)
+        if out is None:
+            out = np.empty(np.shape(rhs))
+        if self._backend == Backend.NUMBA and self._alpha.ndim == 1:
+            kernels.solve_tridiagonal(self._lower, self._alpha, self._denominator, np.asarray(rhs, dtype=float), out)
+        elif np.ndim(rhs) == 1:
+            out[:] = self._solve_single(rhs, self._lower_list, self._alpha_list, self._denominator_list)
+        elif self._backend != Backend.PYTHON and len(rhs) >= self.MIN_VECTORIZED_BATCH:
+            out[:] = self._solve_batch(rhs).T
+        elif self._alpha.ndim == 1:
+            for j in range(len(rhs)):
+                out[j] = self._solve_single(rhs[j], self._lower_list, self._alpha_list, self._denominator_list)
+        else:
+            for j, (lower, alpha, denominator) in enumerate(self._get_rows_lists()):
+                out[j] = self._solve_single(rhs[j], lower, alpha, denominator)
+        return out
+
+    def _get_rows_lists(self) -> List[Tuple[List[float], List[float], List[float]]]:
+        if self._rows_lists is None:
+            self._rows_lists = list(zip(self._lower.tolist(), self._alpha.tolist(), self._denominator.tolist()))
+        return self._rows_lists
+
+    def _solve_single(self,
+                      rhs: np.ndarray,
+                      lower: List[float],
+                      alpha: List[float],
+                      denominator: List[float]) -> List[float]:
+        n = self._n
+        d = rhs.tolist()
+
+        beta = [0.] * n
+        beta[0] = d[0] / denominator[0]
+        for i in range(1, n):
+            beta[i] = (d[i] - lower[i] * beta[i - 1]) / denominator[i]
+
+        u = [0.] * n
+        u[n - 1] = beta[n - 1]
+        for i in range(n - 2, -1, -1):
+            u[i] = alpha[i] * u[i + 1] + beta[i]
+        return u
+
+    def _solve_batch(self, rhs: np.ndarray) -> np.ndarray:
+        n = self._n
+        d = np.ascontiguousarray(np.transpose(rhs))
+        lower = self._lower_list
+        alpha = self._alpha_list
+        denominator = self._denominator_list
+
+        beta = np.empty_like(d)
+        beta[0] = d[0] / denominator[0]
+        for i in range(1, n):
+            beta[i] = (d[i] - lower[i] * beta[i - 1]) / denominator[i]
+
+        u = beta
+        for i in range(n - 2, -1, -1):
+            u[i] = alpha[i] * u[i + 1] + beta[i]
+        return u
+
+    def get_alpha(self) -> np.ndarray:
+        return self._alpha
+
+    def get_denominator(self) -> np.ndarray:
+        return self._denominator
+
+    def get_backend(self) -> Backend:
+        return self._backend
@@ -0,0 +1,194 @@
+from collections import OrderedDict
+from typing import *
+import hashlib
+import os
+import threading
+import numpy as np
+
+from app.util import SchemeType, create_analytical, create_numerical
+
+from app.process.process import Process
+from app.process.numerically_calculated_process import NumericallyCalculatedProcess
+from app.process.analytically_calculated_process import AnalyticallyCalculatedProcess
+from app.process.solution_storage import MemmapStorage
+from app.process.process_stats import ProcessStats
+from app.process.cancellation import CancellationToken
+
+
+class ResultCache:
+    # Keeps calculated processes keyed by their parameters and evicts the least
+    # recently used ones once the solutions exceed the memory budget. With a
+    # directory the solutions are also written there and reused across sessions.
+
+    DEFAULT_MEMORY_BUDGET = 512 * 2**20
+
+    def __init__(self, memory_budget: int = DEFAULT_MEMORY_BUDGET, directory: Optional[str] = None):
+        self._memory_budget = memory_budget
+        self._directory = directory
+        self._processes = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_numerical_key(scheme_type: SchemeType, params: List[float or int]) -> Tuple:
+        # eps only affects the analytical solution
+        return (scheme_type.name.lower(),) + tuple(params[:9])
+
+    @staticmethod
+    def get_analytical_key(params: List[float or int]) -> Tuple:
+        return ("analytical",) + tuple(params)
+
+    def get_numerical(self,
+                      scheme_type: SchemeType,
+                      params: List[float or int],
+                      stats: Optional[ProcessStats] = None,
+                      base_params: Optional[List[float or int]] = None,
+                      token: Optional[CancellationToken] = None) -> NumericallyCalculatedProcess:
+        # the stats are only collected when the process is actually calculated,
+        # with base_params the process cached for them is extended if only the horizon differs
+        key = self.get_numerical_key(scheme_type, params)
+        if base_params is not None:
+            self._derive(self.get_numerical_key(scheme_type, base_params), key,
+                         lambda process: self._extend(process, base_params, params, stats, token))
+        return self.get_or_create(key, lambda calculate, storage: create_numerical(scheme_type, params,
+                                                                                    calculate, storage, stats),
+                                  token)
+
+    def get_analytical(self,
+                       params: List[float or int],
+                       lazy: bool = False,
+                       stats: Optional[ProcessStats] = None,
+                       base_params: Optional[List[float or int]] = None,
+                       token: Optional[CancellationToken] = None) -> AnalyticallyCalculatedProcess:
+        key = self.get_analytical_key(params)
+        if base_params is not None:
+            self._derive(self.get_analytical_key(base_params), key,
+                         lambda process: self._refine(process, base_params, params, stats, token))
+        return self.get_or_create(key, lambda calculate, storage: create_analytical(params, calculate,
+                                                                                     lazy, storage, stats),
+                                  token, not lazy)
+
+    def get_or_create(self,
+                      key: Tuple,
+                      factory: Callable[[bool, Optional[MemmapStorage]], Process],
+                      token: Optional[CancellationToken] = None,
+                      calculate: bool = True) -> Process:
+        # factory(calculate_immediately, storage) creates the process for the key,
+        # a cancelled calculation raises CalculationCancelled and caches nothing
+        process = self.get(key)
+        if process is not None:
+            return process
+
+        storage = self._get_storage(key)
+        process = None
+        if storage is not None and os.path.exists(storage.get_metadata_path()):
+            process = factory(False, None)
+            try:
+                process.load(storage)
+            except ValueError:
+                process = None
+        if process is None:
+            process = factory(False, storage)
+            if calculate:
+                process.calculate(token)
+        self.put(key, process)
+        return process
+
+    def _derive(self, base_key: Tuple, key: Tuple, derive: Callable[[Process], Optional[Process]]):
+        # derive(process) turns a copy of the process cached for base_key into
+        # the one for key, it returns None if the process has to be calculated
+        # anew. The cached process may already be shown, so it is never changed.
+        # Solutions on disk are named after their keys, so only memory is reused.
+        if self._directory is not None or base_key == key:
+            return
+        with self._lock:
+            if key in self._processes or base_key not in self._processes:
+                return
+            process = self._processes[base_key]
+        derived = derive(process)
+        if derived is not None:
+            self.put(key, derived)
+
+    @staticmethod
+    def _extend(process: Process,
+                base_params: List[float or int],
+                params: List[float or int],
+                stats: Optional[ProcessStats] = None,
+                token: Optional[CancellationToken] = None) -> Optional[Process]:
+        # only t (1) and t_num (8) may differ, eps (9) does not affect the numerical solution
+        if any(base_params[i] != params[i] for i in range(9) if i not in (1, 8)):
+            return None
+        if (base_params[1], base_params[8]) == (params[1], params[8]):
+            return process.copy(stats)
+        if not process.can_extend(params[1], params[8]):
+            return None
+        extended = process.copy(stats)
+        extended.extend(params[1], params[8], token)
+        return extended
+
+    @classmethod
+    def _refine(cls, process: AnalyticallyCalculatedProcess,
+                base_params: List[float or int],
+                params: List[float or int],
+                stats: Optional[ProcessStats] = None,
+                token: Optional[CancellationToken] = None) -> Optional[AnalyticallyCalculatedProcess]:
+        refined = cls._extend(process, base_params, params, stats, token)
+        if refined is not None and base_params[9] != params[9]:
+            refined.refine(params[9], token)
+        return refined
+
+    def get(self, key: Tuple) -> Optional[Process]:
+        with self._lock:
+            process = self._processes.get(key)
+            if process is not None:
+                self._processes.move_to_end(key)
+                self._sizes[key] = self._get_size(process)
+                self._evict()
+            return process
+
+    def put(self, key: Tuple, process: Process):
+        with self._lock:
+            self._processes[key] = process
+            self._processes.move_to_end(key)
+            self._sizes[key] = self._get_size(process)
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._processes.clear()
+            self._sizes.clear()
+
+    def get_directory(self) -> Optional[str]:
+        return self._directory
+
+    def get_memory_usage(self) -> int:
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def __len__(self) -> int:
+        return len(self._processes)
+
+    def __contains__(self, key: Tuple) -> bool:
+        return key in self._processes
+
+    def _evict(self):
+        # the most recently used process is kept even if it alone exceeds the budget
+        while len(self._processes) > 1 and sum(self._sizes.values()) > self._memory_budget:
+            key, _ = self._processes.popitem(last=False)
+            del self._sizes[key]
+
+    def _get_storage(self, key: Tuple) -> Optional[MemmapStorage]:
+        if self._directory is None:
+            return None
+        name = hashlib.sha1(repr(key).encode()).hexdigest()
+        return MemmapStorage(os.path.join(self._directory, name))
+
+    @staticmethod
+    def _get_size(process: Process) -> int:
+        # memory mapped solutions live in the page cache rather than in the heap
+        if not process.is_calculated():
+            return 0
+        u = process.get_solution()
+        if isinstance(u, np.memmap):
+            return 0
+        return u.nbytes
@@ -0,0 +1,165 @@
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib import animation
+from PIL import Image, GifImagePlugin
+from typing import *
+import os
+import numpy as np
+
+from app.level_of_detail import decimate
+
+from app.process.process import Process
+from app.process.cancellation import CancellationToken
+
+# The whole evolution of a process is read layer by layer in chunks, so a
+# solution mapped from disk is never loaded wholesale. Long runs are thinned
+# out to a bounded number of rows or frames.
+
+CHUNK_SIZE = 64
+MAX_ROWS = 1000
+MAX_COLUMNS = 1000
+MAX_FRAMES = 300
+
+
+def get_frame_indices(process: Process, max_frames: int) -> np.ndarray:
+    # evenly spread over the retained layers, the first and the last are always kept
+    indices = process.get_snapshot_indices()
+    if len(indices) <= max_frames:
+        return indices
+    positions = np.linspace(0, len(indices) - 1, max_frames).round().astype(int)
+    return indices[np.unique(positions)]
+
+
+def iterate_chunks(process: Process,
+                   indices: np.ndarray,
+                   chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    # yields the layer indices and a copy of those layers, chunk_size at a time
+    for start in range(0, len(indices), chunk_size):
+        chunk = indices[start:start + chunk_size]
+        yield chunk, np.array([process.get_solution_on(index) for index in chunk])
+
+
+def calculate_heatmap(process: Process,
+                      max_rows: int = MAX_ROWS,
+                      max_columns: int = MAX_COLUMNS,
+                      token: Optional[CancellationToken] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # the image has a row per shown layer, the first one at the bottom, the nodes
+    # and the times of its columns and rows are returned with it
+    indices = get_frame_indices(process, max_rows)
+    columns = np.unique(np.linspace(0, process.get_x_num(), max_columns).round().astype(int))
+    image = np.empty((len(indices), len(columns)))
+    for start, (chunk, layers) in zip(range(0, len(indices), CHUNK_SIZE), iterate_chunks(process, indices)):
+        if token is not None:
+            token.check(start / len(indices))
+        image[start:start + len(chunk)] = layers[:, columns]
+
+    return image, process.get_xn()[columns], process.get_tn()[indices]
+
+
+def get_cell_edges(centers: np.ndarray) -> np.ndarray:
+    # the cells meet halfway between the centers, the outer ones are as wide as their neighbours
+    if len(centers) == 1:
+        return np.array([centers[0] - 0.5, centers[0] + 0.5])
+    middles = (centers[1:] + centers[:-1]) / 2
+    return np.concatenate(([2 * centers[0] - middles[0]], middles, [2 * centers[-1] - middles[-1]]))
+
+
+def draw_heatmap(ax, image: np.ndarray, xn: np.ndarray, tn: np.ndarray):
+    # the retained layers may be spread unevenly in time, so every row spans its own layer
+    mappable = ax.pcolormesh(get_cell_edges(xn), get_cell_edges(tn), image, cmap="inferno")
+    ax.set_xlim(xn[0], xn[-1])
+    if len(tn) > 1:
+        ax.set_ylim(tn[0], tn[-1])
+    ax.figure.colorbar(mappable, ax=ax, label="t, °C")
+    ax.set_title("Распределение температуры во времени")
+    ax.set_xlabel("x, см")
+    ax.set_ylabel("Время, c")
+
+
+class GifWriter(animation.AbstractMovieWriter):
+    # Writes every frame to the file as it is grabbed, so no frame outlives its
+    # grab_frame call. The frames share the palette quantized from the first one,
+    # which suits plots of a few flat colours.
+    def __init__(self, fps: int = 5):
+        super().__init__(fps=fps)
+        self._file = None
+        self._palette = None
+
+    def setup(self, fig, outfile, dpi=None):
+        self.fig = fig
+        self.outfile = outfile
+        self.dpi = dpi if dpi is not None else fig.dpi
+        fig.set_dpi(self.dpi)
+        self._file = open(outfile, "wb")
+        self._palette = None
+
+    def grab_frame(self, **savefig_kwargs):
+        data, size = self.fig.canvas.print_to_buffer()
+        image = Image.frombuffer("RGBA", size, data, "raw", "RGBA", 0, 1).convert("RGB")
+        if self._palette is None:
+            frame = self._palette = image.quantize(256)
+            header, _ = GifImagePlugin.getheader(frame, info={"loop": 0, "optimize": False})
+            self._file.write(b"".join(header))
+        else:
+            frame = image.quantize(palette=self._palette)
+        self._file.write(b"".join(GifImagePlugin.getdata(frame, duration=1000 / self.fps)))
+
+    def finish(self):
+        if self._file is not None:
+            self._file.write(b";")
+            self._file.close()
+            self._file = None
+
+
+def create_writer(path: str, fps: int) -> animation.AbstractMovieWriter:
+    # every format is written frame by frame: GIFs in process, the rest through ffmpeg
+    if path.lower().endswith(".gif"):
+        return GifWriter(fps=fps)
+    return animation.FFMpegWriter(fps=fps)
+
+
+def export_animation(process: Process,
+                     path: str,
+                     fps: int = 25,
+                     max_frames: int = MAX_FRAMES,
+                     y_range: Optional[Tuple[float, float]] = None,
+                     dpi: int = 100,
+                     token: Optional[CancellationToken] = None):
+    # Renders off screen, so it may run in any thread. Only a chunk of layers
+    # is held at a time and every frame is decimated to the width of the image.
+    indices = get_frame_indices(process, max_frames)
+    xn, tn = process.get_xn(), process.get_tn()
+    if y_range is None:
+        first, last = process.get_solution_on(indices[0]), process.get_solution_on(indices[-1])
+        low, high = min(first.min(), last.min()), max(first.max(), last.max())
+        margin = 0.05 * (high - low) or 0.5
+        y_range = (low - margin, high + margin)
+
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot(111)
+    ax.set_xlim(xn[0], xn[-1])
+    ax.set_ylim(*y_range)
+    ax.set_ylabel("t, °C")
+    ax.set_xlabel("x, см")
+    ax.grid()
+    line, = ax.plot([], [], color="purple", linewidth=2.0)
+    width = int(figure.get_figwidth() * dpi)
+
+    writer = create_writer(path, fps)
+    try:
+        with writer.saving(figure, path, dpi):
+            frame = 0
+            for chunk, layers in iterate_chunks(process, indices):
+                for index, layer in zip(chunk, layers):
+                    if token is not None:
+                        token.check(frame / len(indices))
+                    line.set_data(*decimate(xn, layer, width))
+                    ax.set_title("Текущее время: {:.2f} c".format(tn[index]))
+                    writer.grab_frame()
+                    frame += 1
+    except BaseException:
+        # a cancelled or failed export leaves no partial file behind
+        if os.path.exists(path):
+            os.remove(path)
+        raise
@@ -0,0 +1,128 @@
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.figure import Figure
+from matplotlib.axes import Axes
+from PyQt5.QtWidgets import *
+from PyQt5.QtCore import *
+from PyQt5.QtGui import *
+from typing import *
+
+from app.calculation_scheduler import CalculationScheduler
+from app.space_time import calculate_heatmap, draw_heatmap, export_animation
+
+from app.process.process import Process
+
+
+class SpaceTimeView(QWidget):
+    # The heatmap of the whole run and the animation export. Both read the
+    # solution in chunks in worker threads, so the window stays responsive.
+
+    figure: Figure
+    ax: Axes
+    canvas: FigureCanvas
+
+    progress_bar: QProgressBar
+    export_btn: QPushButton
+    cancel_btn: QPushButton
+
+    heatmap_scheduler: CalculationScheduler
+    export_scheduler: CalculationScheduler
+
+    close_handler: Callable
+
+    def __init__(self, process: Process, y_range: Tuple[float, float]):
+        super().__init__()
+        self.process = process
+        self.y_range = y_range
+        self.close_handler = lambda: None
+        self.create_ui()
+        self.configure_ui()
+        self.heatmap_scheduler.submit(lambda token: calculate_heatmap(self.process, token=token))
+
+    def heatmap_calculated_handler(self, result: Tuple):
+        image, xn, tn = result
+        self.ax.clear()
+        self.ax.axis("on")
+        draw_heatmap(self.ax, image, xn, tn)
+        self.canvas.draw()
+
+    def heatmap_failed_handler(self, error: Exception):
+        self.ax.clear()
+        self.ax.axis("off")
+        self.ax.text(0.5, 0.5, "Не удалось построить диаграмму", va="center", ha="center", fontsize=15)
+        self.canvas.draw()
+        QMessageBox.warning(self, "Ошибка", "Не удалось построить диаграмму: {}".format(error))
+
+    def start_export(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Сохранить анимацию", "", "GIF (*.gif);;MP4 (*.mp4)")
+        if not path:
+            return
+        self.set_exporting(True)
+        self.export_scheduler.submit(lambda token: export_animation(self.process, path, y_range=self.y_range,
+                                                                    token=token))
+
+    def cancel_export(self):
+        self.export_scheduler.cancel()
+        self.set_exporting(False)
+
+    def finish_export(self, _):
+        self.set_exporting(False)
+
+    def export_failed_handler(self, error: Exception):
+        self.set_exporting(False)
+        QMessageBox.warning(self, "Ошибка", "Не удалось сохранить анимацию: {}".format(error))
+
+    def set_exporting(self, trigger):
+        self.progress_bar.setValue(0)
+        self.progress_bar.setVisible(trigger)
+        self.cancel_btn.setVisible(trigger)
+        self.export_btn.setVisible(not trigger)
+
+    def set_close_handler(self, handler: Callable):
+        self.close_handler = handler
+
+    def create_ui(self):
+        self.figure = Figure()
+        self.ax = self.figure.add_subplot(111)
+        self.canvas = FigureCanvas(self.figure)
+        self.progress_bar = QProgressBar()
+        self.export_btn = QPushButton()
+        self.cancel_btn = QPushButton()
+        self.heatmap_scheduler = CalculationScheduler(self)
+        self.export_scheduler = CalculationScheduler(self)
+
+    def configure_ui(self):
+        self.ax.axis("off")
+        self.ax.text(0.5, 0.5, "Выполняется построение...", va="center", ha="center", fontsize=15)
+
+        self.progress_bar.setRange(0, 100)
+        self.export_btn.setText("Сохранить анимацию")
+        self.cancel_btn.setText("Отмена")
+
+        self.heatmap_scheduler.calculated.connect(self.heatmap_calculated_handler)
+        self.heatmap_scheduler.failed.connect(self.heatmap_failed_handler)
+        self.export_scheduler.progress.connect(self.progress_bar.setValue)
+        self.export_scheduler.calculated.connect(self.finish_export)
+        self.export_scheduler.failed.connect(self.export_failed_handler)
+        self.export_btn.clicked.connect(self.start_export)
+        self.cancel_btn.clicked.connect(self.cancel_export)
+
+        footer = QHBoxLayout()
+        footer.addWidget(self.progress_bar)
+        footer.addWidget(self.cancel_btn)
+        footer.addWidget(self.export_btn)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.canvas)
+        layout.addLayout(footer)
+        self.setLayout(layout)
+        self.set_exporting(False)
+
+        self.setWindowTitle("Пространственно-временная диаграмма")
+        self.resize(800, 600)
+
+    def closeEvent(self, event):
+        for scheduler in (self.heatmap_scheduler, self.export_scheduler):
+            scheduler.cancel()
+            scheduler.wait()
+        self.close_handler()
+        event.accept()
@@ -1,46 +1,158 @@
+from collections import OrderedDict
 from enum import Enum
-from typing import Callable, List
+from typing import Any, Callable, Dict, List, Optional
+import time
+import numpy as np
 
 
 from app.process.numerically_calculated_process import NumericallyCalculatedProcess
-from app.process.explicitly_calculated_process import ExplicitlyCalculatedProcess
+from app.process.explicitly_calculated_process import ExplicitlyCalculatedProcess, StabilityMode
 from app.process.inexplicitly_calculated_process import InexplicitlyCalculatedProcess
+from app.process.crank_nicolson_calculated_process import CrankNicolsonCalculatedProcess
 from app.process.analytically_calculated_process import AnalyticallyCalculatedProcess
+from app.process.multi_rod_process import MultiRodProcess
+from app.process.solution_storage import SolutionStorage
+from app.process.grid_function import GridFunction, ConstantFunction, ArrayFunction
+from app.process.process_stats import ProcessStats
+
+
+PARAMS_NAMES = ["l", "t", "s", "a", "k", "c", "u0", "x_num", "t_num", "eps"]
 
 
 class SchemeType(Enum):
     EXPLICIT = 1
     INEXPLICIT = 2
+    CRANK_NICOLSON = 3
 
 
 def create_analytical(params: List[float or int],
-                      calculate_immediately: bool = True):
+                      calculate_immediately: bool = True,
+                      lazy: bool = False,
+                      storage: Optional[SolutionStorage] = None,
+                      stats: Optional[ProcessStats] = None) -> AnalyticallyCalculatedProcess:
     (l, t, s, a, k, c, u0, x_num, t_num, eps) = params
-    phi: Callable = lambda x: 0
-    xi: Callable = lambda x: -4 * x ** 2 / l ** 2 + 4 * x / l + u0
-    return AnalyticallyCalculatedProcess(l, t, s, a, k, c, u0, phi, xi, x_num, t_num, eps, calculate_immediately)
+    phi: GridFunction = ConstantFunction(0)
+    xi: GridFunction = ArrayFunction(lambda x: -4 * x ** 2 / l ** 2 + 4 * x / l + u0)
+    return AnalyticallyCalculatedProcess(l, t, s, a, k, c, u0, phi, xi, x_num, t_num, eps,
+                                         calculate_immediately, lazy, storage, stats)
 
 
 def create_explicit(params: List[float or int],
-                    calculate_immediately: bool = True) -> ExplicitlyCalculatedProcess:
+                    calculate_immediately: bool = True,
+                    storage: Optional[SolutionStorage] = None,
+                    stats: Optional[ProcessStats] = None,
+                    stability: StabilityMode = StabilityMode.UNCHECKED,
+                    phi: Optional[GridFunction or Callable] = None) -> ExplicitlyCalculatedProcess:
     (l, t, s, a, k, c, u0, x_num, t_num, eps) = params
-    phi: Callable = lambda x: 0
-    xi: Callable = lambda x: -4 * x ** 2 / l ** 2 + 4 * x / l + u0
-    return ExplicitlyCalculatedProcess(l, t, s, a, k, c, u0, phi, xi, x_num, t_num, calculate_immediately)
+    phi = phi if phi is not None else ConstantFunction(0)
+    xi: GridFunction = ArrayFunction(lambda x: -4 * x ** 2 / l ** 2 + 4 * x / l + u0)
+    return ExplicitlyCalculatedProcess(l, t, s, a, k, c, u0, phi, xi, x_num, t_num, calculate_immediately,
+                                       storage=storage, stats=stats, stability=stability)
 
 
 def create_inexplicit(params: List[float or int],
-                      calculate_immediately: bool = True) -> InexplicitlyCalculatedProcess:
+                      calculate_immediately: bool = True,
+                      storage: Optional[SolutionStorage] = None,
+                      stats: Optional[ProcessStats] = None,
+                      tolerance: Optional[float] = None,
+                      phi: Optional[GridFunction or Callable] = None) -> InexplicitlyCalculatedProcess:
     (l, t, s, a, k, c, u0, x_num, t_num, eps) = params
-    phi: Callable = lambda x: 0
-    xi: Callable = lambda x: -4 * x ** 2 / l ** 2 + 4 * x / l + u0
-    return InexplicitlyCalculatedProcess(l, t, s, a, k, c, u0, phi, xi, x_num, t_num, calculate_immediately)
+    phi = phi if phi is not None else ConstantFunction(0)
+    xi: GridFunction = ArrayFunction(lambda x: -4 * x ** 2 / l ** 2 + 4 * x / l + u0)
+    return InexplicitlyCalculatedProcess(l, t, s, a, k, c, u0, phi, xi, x_num, t_num, calculate_immediately,
+                                         storage=storage, stats=stats, tolerance=tolerance)
+
+
+def create_crank_nicolson(params: List[float or int],
+                          calculate_immediately: bool = True,
+                          storage: Optional[SolutionStorage] = None,
+                          stats: Optional[ProcessStats] = None,
+                          phi: Optional[GridFunction or Callable] = None) -> CrankNicolsonCalculatedProcess:
+    (l, t, s, a, k, c, u0, x_num, t_num, eps) = params
+    phi = phi if phi is not None else ConstantFunction(0)
+    xi: GridFunction = ArrayFunction(lambda x: -4 * x ** 2 / l ** 2 + 4 * x / l + u0)
+    return CrankNicolsonCalculatedProcess(l, t, s, a, k, c, u0, phi, xi, x_num, t_num, calculate_immediately,
+                                          storage=storage, stats=stats)
 
 
 def create_numerical(scheme_type: SchemeType,
                      params: List[float or int],
-                     calculate_immediately: bool = True) -> NumericallyCalculatedProcess:
+                     calculate_immediately: bool = True,
+                     storage: Optional[SolutionStorage] = None,
+                     stats: Optional[ProcessStats] = None,
+                     phi: Optional[GridFunction or Callable] = None) -> NumericallyCalculatedProcess:
+    # without phi there is no source, as the analytical solution assumes
     if scheme_type == SchemeType.EXPLICIT:
-        return create_explicit(params, calculate_immediately)
+        return create_explicit(params, calculate_immediately, storage, stats, phi=phi)
     elif scheme_type == SchemeType.INEXPLICIT:
-        return create_inexplicit(params, calculate_immediately)
+        return create_inexplicit(params, calculate_immediately, storage, stats, phi=phi)
+    elif scheme_type == SchemeType.CRANK_NICOLSON:
+        return create_crank_nicolson(params, calculate_immediately, storage, stats, phi=phi)
+
+
+def create_multi_rod(scheme_type: SchemeType,
+                     params: List[float or int],
+                     u0: List[float],
+                     xi: Optional[List[GridFunction or Callable]] = None,
+                     calculate_immediately: bool = True,
+                     storage: Optional[SolutionStorage] = None,
+                     stats: Optional[ProcessStats] = None) -> MultiRodProcess:
+    # u0 of params is replaced by the ambient temperatures of the rods,
+    # without xi every rod starts with the default profile around its own u0
+    (l, t, s, a, k, c, _, x_num, t_num, eps) = params
+    if xi is None:
+        xi = [ArrayFunction(lambda x, u0=rod_u0: -4 * x ** 2 / l ** 2 + 4 * x / l + u0) for rod_u0 in u0]
+    scheme = {
+        SchemeType.EXPLICIT: ExplicitlyCalculatedProcess,
+        SchemeType.INEXPLICIT: InexplicitlyCalculatedProcess,
+        SchemeType.CRANK_NICOLSON: CrankNicolsonCalculatedProcess
+    }[scheme_type]
+    phi: GridFunction = ConstantFunction(0)
+    return MultiRodProcess(scheme, l, t, s, a, k, c, u0, phi, xi, x_num, t_num, calculate_immediately,
+                           storage=storage, stats=stats)
+
+
+def sweep(scheme_type: SchemeType,
+          param_sets: List[List[float or int]],
+          calculate_error: bool = True) -> List[Dict[str, Any]]:
+    # Points sharing (l, t, x_num, t_num) share one grid and are stepped together,
+    # every rod is a row of a (points, x_num + 1) layer with its own coefficients.
+    groups = OrderedDict()
+    for index, params in enumerate(param_sets):
+        (l, t, s, a, k, c, u0, x_num, t_num, eps) = params
+        groups.setdefault((l, t, int(x_num), int(t_num)), []).append(index)
+
+    results = [None] * len(param_sets)
+    for (l, t, x_num, t_num), indices in groups.items():
+        start = time.perf_counter()
+        points = [param_sets[index] for index in indices]
+        columns = [np.array([params[i] for params in points], dtype=float)[:, np.newaxis] for i in range(2, 7)]
+        (s, a, k, c, u0) = columns
+        numerical = create_numerical(scheme_type, [l, t, s, a, k, c, u0, x_num, t_num, None], False)
+
+        initial_layers = []
+        for params in points:
+            xi: GridFunction = ArrayFunction(lambda x: -4 * x ** 2 / l ** 2 + 4 * x / l + params[6])
+            initial_layers.append(xi.evaluate(numerical.get_xn()))
+
+        errors = np.zeros(len(points))
+        if calculate_error:
+            analyticals = [create_analytical(params, False).iterate_layers() for params in points]
+            for (_, layer), exact_layers in zip(numerical.iterate_batch(initial_layers), zip(*analyticals)):
+                exact = np.array([exact_layer for _, exact_layer in exact_layers])
+                np.maximum(errors, np.absolute(layer - exact).max(axis=-1), out=errors)
+        else:
+            for _ in numerical.iterate_batch(initial_layers):
+                pass
+        elapsed = (time.perf_counter() - start) / len(points)
+
+        for position, index in enumerate(indices):
+            result = {"index": index, "scheme": scheme_type.name.lower()}
+            result.update(zip(PARAMS_NAMES, param_sets[index]))
+            result["hx"] = float(numerical.get_hx())
+            result["ht"] = float(numerical.get_ht())
+            result["time"] = elapsed
+            if calculate_error:
+                result["error"] = float(errors[position])
+            results[index] = result
+    return results
@@ -0,0 +1,5 @@
+import sys
+from app.headless import main
+
+if __name__ == "__main__":
+    exit(main(sys.argv[1:]))
@@ -0,0 +1,157 @@
+from typing import *
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+from app.util import SchemeType, create_analytical, create_numerical
+from app.process import kernels
+from app.process.kernels import Backend
+
+DEFAULT_PARAMS = [10, 50, 0.01, 0.005, 0.65, 1.84, 20, 55, 3000, 0.01]
+
+# (x_num, t_num) pairs, t_num keeps the explicit scheme stable for DEFAULT_PARAMS
+QUICK_GRIDS = [(55, 3000), (100, 5000)]
+FULL_GRIDS = QUICK_GRIDS + [(200, 20000), (400, 60000)]
+QUICK_EPS = [1e-2, 1e-3]
+FULL_EPS = QUICK_EPS + [1e-4, 1e-5]
+
+SOLVERS = ["explicit", "inexplicit", "crank_nicolson", "analytical"]
+
+
+def create_process(solver: str, params: List[float or int]):
+    if solver == "analytical":
+        return create_analytical(params, calculate_immediately=False)
+    return create_numerical(SchemeType[solver.upper()], params, calculate_immediately=False)
+
+
+def measure(solver: str, x_num: int, t_num: int, eps: float, repeat: int) -> Dict[str, Any]:
+    params = list(DEFAULT_PARAMS)
+    params[7], params[8], params[9] = x_num, t_num, eps
+
+    construct_time = calculate_time = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        process = create_process(solver, params)
+        constructed = time.perf_counter()
+        process.calculate()
+        calculated = time.perf_counter()
+        construct_time = min(construct_time, constructed - start)
+        calculate_time = min(calculate_time, calculated - constructed)
+
+    # tracing slows allocations down, so the memory is measured by a separate run
+    tracemalloc.start()
+    create_process(solver, params).calculate()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "solver": solver,
+        "x_num": x_num,
+        "t_num": t_num,
+        "eps": eps if solver == "analytical" else None,
+        "construct_time": construct_time,
+        "calculate_time": calculate_time,
+        "peak_memory": peak_memory,
+        "node_updates_per_second": (x_num + 1) * t_num / calculate_time
+    }
+
+
+def get_cases(quick: bool, solvers: List[str]) -> List[Tuple[str, int, int, Optional[float]]]:
+    grids = QUICK_GRIDS if quick else FULL_GRIDS
+    eps_values = QUICK_EPS if quick else FULL_EPS
+    cases = []
+    for solver in solvers:
+        for x_num, t_num in grids:
+            if solver == "analytical":
+                cases.extend((solver, x_num, t_num, eps) for eps in eps_values)
+            else:
+                cases.append((solver, x_num, t_num, None))
+    return cases
+
+
+def get_environment() -> Dict[str, Any]:
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "backend": kernels.get_default_backend().name.lower(),
+        "machine": platform.machine(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")
+    }
+
+
+def run(quick: bool, solvers: List[str], repeat: int) -> Dict[str, Any]:
+    results = []
+    for solver, x_num, t_num, eps in get_cases(quick, solvers):
+        result = measure(solver, x_num, t_num, eps if eps is not None else DEFAULT_PARAMS[9], repeat)
+        print("{:<11} x_num={:<5} t_num={:<6} eps={:<8} {:9.4f} s {:10.1f} MB {:14.0f} nodes/s".format(
+            solver, x_num, t_num, str(result["eps"] or "-"), result["calculate_time"],
+            result["peak_memory"] / 2**20, result["node_updates_per_second"]))
+        results.append(result)
+    return {"environment": get_environment(), "results": results}
+
+
+def get_case_key(result: Dict[str, Any]) -> Tuple:
+    return result["solver"], result["x_num"], result["t_num"], result["eps"]
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> List[Tuple]:
+    baseline_results = {get_case_key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        previous = baseline_results.get(get_case_key(result))
+        if previous is None:
+            continue
+        ratio = result["calculate_time"] / previous["calculate_time"]
+        marker = "REGRESSION" if ratio > 1 + threshold else ""
+        print("{:<11} x_num={:<5} t_num={:<6} eps={:<8} {:9.4f} s -> {:9.4f} s  x{:.2f} {}".format(
+            result["solver"], result["x_num"], result["t_num"], str(result["eps"] or "-"),
+            previous["calculate_time"], result["calculate_time"], ratio, marker))
+        if marker:
+            regressions.append(get_case_key(result))
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks the heat exchange process solvers.")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--quick", action="store_true", help="only the smallest grids")
+    parser.add_argument("--solvers", nargs="+", choices=SOLVERS, default=SOLVERS)
+    parser.add_argument("--backend", choices=[backend.name.lower() for backend in Backend],
+                        help="kernel backend of the numerical solvers (default: the fastest available)")
+    parser.add_argument("--repeat", type=int, default=3, help="the best of this many runs is reported")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="compare two result files instead of running the benchmark")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative slowdown reported as a regression (default: 0.1)")
+    args = parser.parse_args(argv)
+
+    if args.compare is not None:
+        with open(args.compare[0]) as baseline_file, open(args.compare[1]) as current_file:
+            regressions = compare(json.load(baseline_file), json.load(current_file), args.threshold)
+        print("{} regression(s) above {:.0%}".format(len(regressions), args.threshold))
+        return 1 if regressions else 0
+
+    if args.backend is not None:
+        try:
+            kernels.set_default_backend(Backend[args.backend.upper()])
+        except ValueError as error:
+            parser.error(str(error))
+    report = run(args.quick, args.solvers, args.repeat)
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())